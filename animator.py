@@ -209,7 +209,7 @@ class EntityLoader:
 				# set bonesprites of animator
 				for si in sprites:
 					bonename = sprites[si]
-					animator.add_bonesprite(bonename)
+					animator.add_bonesprite(self.spritebatch, bonename)
 		
 		player = None
 		if (not playerenable is None):
@@ -277,6 +277,10 @@ class AnimationLoader:
 		self.framebyanimdata = json.load(fin)
 		fin.close()
 
+		# composited skelly frames, shared by every animator playing them.
+		# (animname, frame, scale, fliphorz, bonesprites) -> (image, anchor)
+		self.framecache = {}
+
 	def get(self, animindex):
 		if (animindex >= self.length):
 			return None
@@ -302,6 +306,48 @@ class AnimationLoader:
 
 		return result
 
+	def clear_framecache(self):
+		self.framecache.clear()
+
+	def get_skellyframe(self, sb, animation, frame, scale, fliphorz, bonesprites):
+		key = (animation.name, frame, scale, fliphorz, bonesprites)
+		result = self.framecache.get(key)
+		if (result is None):
+			result = composite_skellyframe(sb, animation, frame, scale, fliphorz, bonesprites)
+			self.framecache[key] = result
+		return result
+
+'''
+Scales and rotates every bone of one frame once, and blits them all onto a
+single surface. Returns the surface and the offset of its top left corner
+from the entity position, so drawing the frame is one blit.
+'''
+def composite_skellyframe(sb, animation, frame, scale, fliphorz, bonesprites):
+	indexstart = frame * animation.numbones
+
+	bones = []
+	for bi in range(animation.numbones):
+		si = bonesprites[bi]
+		if (not si is None):
+			pos = animation.bonepos[indexstart + bi]
+			rot = animation.bonerot[indexstart + bi]
+			bonedim = v2_int(tuple_mult(sb.get(si).get_image().get_size(), scale))
+			isrot = (pos, bonedim, rot)
+			bones.append(sb.draw_isrot(si, isrot, fliphorz=fliphorz))
+
+	if (len(bones) == 0):
+		result = (pygame.Surface((0, 0), pygame.SRCALPHA), (0, 0))
+		return result
+
+	bounds = bones[0][1].unionall([rect for image, rect in bones[1:]])
+
+	image = pygame.Surface(bounds.size, pygame.SRCALPHA)
+	for boneimage, rect in bones:
+		image.blit(boneimage, (rect.x - bounds.x, rect.y - bounds.y))
+
+	result = (image, (bounds.x, bounds.y))
+	return result
+
 class SkellyAnimation:
 	#def __init__(self, name, numbones, numframes, repeat):
 	def __init__(self, name, adata):
@@ -346,8 +392,7 @@ class SkellyAnimator:
 		self.load(name)
 		self.curranimation = self.get_animation(self.defaultanimationname)
 
-		self.bonesprites = []
-		self.numbones
+		self.bonesprites = ()
 		'''
 		bonesprites are sort of baked in. The animation data just says 
 		"what ever is drawn in the first layer, is drawn at these position and rots."
@@ -359,26 +404,21 @@ class SkellyAnimator:
 		# draw counter
 		self.currframe = 0
 
-	def add_bonesprite(self, bsname):
-		bonespriteindex = self.bonesprites.append(sb.add(bsname))
-		self.bonesprites.append(bonespriteindex)
+	def add_bonesprite(self, sb, bsname):
+		# tuple, so it can be part of the frame cache key
+		self.bonesprites = self.bonesprites + (sb.add(bsname),)
 
 	def draw(self, sb, camera, facingdir):
 		animation = self.curranimation
 		result = []
 
-		indexstart = self.currframe * self.numbones
-
+		fliphorz = (facingdir <= 0)
 		epos = (self.entity.x, self.entity.y)
 
-		for bi in range(animation.numbones):
-			si = self.bonesprites[bi]
-			if (not si is None):
-				pos = animation.bonepos[indexstart + bi]
-				rot = animation.bonerot[indexstart + bi]
-				pos = v2_add(pos, epos)
-				isrot = (pos, rot, self.scale)
-				result.append(sb.draw_isrot(si, isrot, fliphorz=fliphorz))
+		image, anchor = self.animationloader.get_skellyframe(
+			sb, animation, self.currframe, self.scale, fliphorz, self.bonesprites)
+		rect = Rect(v2_add(anchor, epos), image.get_size())
+		result.append((image, rect.get_pyrect()))
 
 		# increase frame counter, set next animation if needed
 		self.currframe += 1
@@ -441,27 +481,49 @@ class InputDataIndex(IntEnum):
 	ACTIVATE = 6
 	GUARD = 7
 
+'''
+Ring buffer of the last maxqueuelength frames of input vars. A new frame
+writes over the oldest one instead of shifting every var's list. For every
+var, lastseen has the last frame number each value was set in, so had_var()
+is a lookup instead of a scan back through the frames. Setting a var again
+in the same frame puts back the lastseen of the value it replaces.
+'''
 class InputDataBuffer:
 	def __init__(self):
 		self.maxqueuelength = MAXINPUTQUEUELEN
 		self.queuelength = 0
+		self.framenum = -1 # counts up forever, unlike head
+		self.head = -1 # current frame in the ring
 
 		self.vars = []
+		self.lastseen = [] # value -> framenum
+		self.replaced = [] # lastseen of each var's current value before this frame
 
 		# append in order of input data index enum
 		for inputtype in InputDataIndex:
-			self.vars.append([])
-
-	def newinput(self, curr_input, prev_input):
-		if (self.queuelength == self.maxqueuelength):
-			for varlist in self.vars:
-				varlist.pop(0)
-		else:
+			self.vars.append([0]*self.maxqueuelength)
+			self.lastseen.append({})
+			self.replaced.append(None)
+
+	# start a new frame with default values
+	def push(self):
+		self.framenum += 1
+		self.head += 1
+		if (self.head == self.maxqueuelength):
+			self.head = 0
+		if (self.queuelength < self.maxqueuelength):
 			self.queuelength += 1
 
-		# put in default values
-		for varlist in self.vars:
-			varlist.append(0)
+		framenum = self.framenum
+		head = self.head
+		for vi in range(len(self.vars)):
+			self.vars[vi][head] = 0
+			lastseen = self.lastseen[vi]
+			self.replaced[vi] = lastseen.get(0)
+			lastseen[0] = framenum
+
+	def newinput(self, curr_input, prev_input):
+		self.push()
 
 		# movement
 		moveinputvecx, moveinputvecy = (0, 0)
@@ -483,22 +545,32 @@ class InputDataBuffer:
 			self.set_var(InputDataIndex.DODGE, 1)
 
 	def set_var(self, var_idi, val):
-		self.vars[var_idi][self.queuelength-1] = val
+		varlist = self.vars[var_idi]
+		old = varlist[self.head]
+		if (old != val):
+			# this frame doesn't have old anymore
+			lastseen = self.lastseen[var_idi]
+			replaced = self.replaced[var_idi]
+			if (replaced is None):
+				del lastseen[old]
+			else:
+				lastseen[old] = replaced
+
+			self.replaced[var_idi] = lastseen.get(val)
+			lastseen[val] = self.framenum
+			varlist[self.head] = val
 		return val
 
 	def get_var(self, var_idi):
-		result = self.vars[var_idi][self.queuelength-1]
+		result = self.vars[var_idi][self.head]
 		return result
 
+	# whether var was val in any of the last frames frames, this one included
 	def had_var(self, var_idi, val, frames=MAXINPUTQUEUELEN):
 		assert(frames > 0)
-		frame = self.queuelength-1
-		result = False
-		while (frame >= 0 and frame >= self.queuelength-frames):
-			if (self.vars[var_idi][frame] == val):
-				result = True
-				return result
-			frame -= 1
+		frames = min(frames, self.queuelength)
+		seen = self.lastseen[var_idi].get(val)
+		result = (not seen is None and seen > self.framenum-frames)
 		return result
 
 class SpriteSheet:
@@ -0,0 +1,172 @@
+import pygame
+import sys
+import json
+import hashlib
+
+# constants
+ATLAS_MAX_WIDTH = 1024
+ATLAS_MAX_HEIGHT = 1024
+ATLAS_PADDING = 1
+
+SPRITEDATA_FILE = './data/graphics/spritedata.json'
+ATLASDATA_FILE = './data/graphics/atlasdata.json'
+ATLAS_FILE = './data/graphics/atlas%d.png'
+
+'''
+Offline tool: packs every sprite in spritedata.json into as few atlas images as
+possible and writes a manifest that SpriteBatch uses to hand out subsurfaces
+of the atlases instead of opening each png separately.
+
+Packing is simple shelf packing: tallest sprites first, left to right,
+starting a new shelf when the row is full and a new atlas when the page is.
+
+The manifest records a hash of spritedata.json, which the game checks once
+when it loads the manifest: if the sprite list has changed since the build the
+whole atlas is ignored and every sprite loads from its own png. Editing a png
+in place doesn't change spritedata.json, so each sprite's entry also records a
+hash of its png, and 'python atlasbuilder.py check' lists the sprites whose
+png no longer matches. Hashes rather than mtimes, since a checkout touches
+every file.
+'''
+
+class AtlasPage:
+	def __init__(self):
+		self.sprites = [] # [(name, image, (x, y)), ...]
+		self.shelfx = 0
+		self.shelfy = 0
+		self.shelfheight = 0
+		self.width = 0
+		self.height = 0
+
+	def place(self, name, image):
+		w, h = image.get_size()
+
+		if (self.shelfx + w > ATLAS_MAX_WIDTH):
+			# start a new shelf under the current one
+			self.shelfy += self.shelfheight + ATLAS_PADDING
+			self.shelfx = 0
+			self.shelfheight = 0
+
+		if (self.shelfy + h > ATLAS_MAX_HEIGHT or w > ATLAS_MAX_WIDTH):
+			return False
+
+		pos = (self.shelfx, self.shelfy)
+		self.sprites.append((name, image, pos))
+
+		self.shelfx += w + ATLAS_PADDING
+		self.shelfheight = max(self.shelfheight, h)
+		self.width = max(self.width, pos[0] + w)
+		self.height = max(self.height, pos[1] + h)
+
+		return True
+
+	def render(self):
+		result = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+		result.fill((0, 0, 0, 0))
+		for name, image, pos in self.sprites:
+			# max-blend onto a cleared page copies pixels (incl. alpha) exactly
+			result.blit(image, pos, special_flags=pygame.BLEND_RGBA_MAX)
+		return result
+
+def get_filehash(filename):
+	fin = open(filename, 'rb')
+	result = hashlib.sha1(fin.read()).hexdigest()
+	fin.close()
+	return result
+
+def pack_sprites(spritedata):
+	images = []
+	for name in spritedata:
+		image = pygame.image.load(spritedata[name]['file'])
+		images.append((name, image))
+
+	# tallest first keeps shelves tight
+	images.sort(key=lambda ni: (-ni[1].get_height(), -ni[1].get_width(), ni[0]))
+
+	result = [AtlasPage()]
+	for name, image in images:
+		if (not result[-1].place(name, image)):
+			result.append(AtlasPage())
+			# only fails if the sprite is bigger than an empty page
+			placed = result[-1].place(name, image)
+			assert(placed)
+
+	return result
+
+def save_atlases(pages, spritedata, spritedatahash):
+	manifest = {
+		"datatype" : "atlas",
+		"spritedata" : spritedatahash,
+		"atlases" : {},
+		"sprites" : {}
+	}
+
+	for pagenum in range(len(pages)):
+		page = pages[pagenum]
+		filename = ATLAS_FILE % pagenum
+		pygame.image.save(page.render(), filename)
+		manifest["atlases"][str(pagenum)] = {"file" : filename}
+
+		for name, image, pos in page.sprites:
+			manifest["sprites"][name] = {
+				"atlas" : str(pagenum),
+				"x" : pos[0],
+				"y" : pos[1],
+				"width" : image.get_width(),
+				"height" : image.get_height(),
+				"file" : spritedata[name]['file'],
+				"sha1" : get_filehash(spritedata[name]['file'])
+			}
+
+	with open(ATLASDATA_FILE, 'w') as f:
+		json.dump(manifest, f, indent='\t')
+
+	return manifest
+
+# sprites whose png has changed since the atlas was built, or that it's missing
+def get_stalesprites(manifest, spritedata):
+	result = []
+	for name in sorted(spritedata):
+		sdata = manifest["sprites"].get(name)
+		filename = spritedata[name]['file']
+		if (sdata is None or sdata.get("file") != filename
+			or sdata.get("sha1") != get_filehash(filename)):
+			result.append(name)
+	return result
+
+def main(argv):
+	pygame.init()
+
+	fin = open(SPRITEDATA_FILE, 'rb')
+	spritedatabytes = fin.read()
+	fin.close()
+	spritedata = json.loads(spritedatabytes)
+	spritedatahash = hashlib.sha1(spritedatabytes).hexdigest()
+
+	if (len(argv) > 0 and argv[0] == 'check'):
+		fin = open(ATLASDATA_FILE)
+		manifest = json.load(fin)
+		fin.close()
+
+		stale = get_stalesprites(manifest, spritedata)
+		if (manifest.get("spritedata") != spritedatahash):
+			print('spritedata.json has changed since the atlas was built')
+		for name in stale:
+			print('\t%s (%s)' % (name, spritedata[name]['file']))
+		pygame.quit()
+		if (len(stale) > 0 or manifest.get("spritedata") != spritedatahash):
+			sys.exit(1)
+		print('atlas is up to date')
+		return
+
+	pages = pack_sprites(spritedata)
+	manifest = save_atlases(pages, spritedata, spritedatahash)
+
+	print('packed %d sprites into %d atlas(es):' % (len(manifest["sprites"]), len(pages)))
+	for pagenum in range(len(pages)):
+		print('\t%s (%d x %d)' % (ATLAS_FILE % pagenum, pages[pagenum].width, pages[pagenum].height))
+
+	pygame.quit()
+
+if __name__=='__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,51 @@
+import os
+# no window for the tests, set before pygame gets imported
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pytest
+import main
+
+
+@pytest.fixture
+def spritebatch():
+	result = main.SpriteBatch()
+	return result
+
+
+@pytest.fixture
+def entityloader(spritebatch):
+	result = main.EntityLoader(spritebatch)
+	return result
+
+
+# load_map(mapname) -> MapData
+@pytest.fixture
+def load_map(spritebatch):
+	def load(mapname="widemap"):
+		result = main.MapData()
+		result.load(mapname, spritebatch)
+		return result
+	return load
+
+
+# create_world(mapname) -> (worldstate, geometry, player), the local player at the spawn
+@pytest.fixture
+def create_world(entityloader, load_map):
+	def create(mapname="widemap"):
+		geometry = load_map(mapname)
+		worldstate = main.WorldState()
+		player = entityloader.create_entity("player-local", position=geometry.get_spawn())
+		worldstate.add_entity(player)
+		return worldstate, geometry, player
+	return create
+
+
+# create_body(position) -> an Entity with nothing but a physics body
+@pytest.fixture
+def create_body():
+	def create(position, widthintiles=1, heightintiles=1):
+		result = main.Entity(
+			position=position, physics=main.PhysicsBody(widthintiles, heightintiles),
+			spriteindex=0)
+		return result
+	return create
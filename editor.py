@@ -1,6 +1,7 @@
 import pygame
 from math import sqrt
 from enum import IntEnum
+from bisect import bisect_left, insort
 from tkinter import Tk 
 from tkinter.filedialog import askopenfilename
 import sys
@@ -291,6 +292,8 @@ def newmap(spritebatch):
 				x, y = i*2, j*2
 				result.spriteindex_geo[x + width * y] = index
 
+	result.spriterows_geo = result.build_spriterows(result.spriteindex_geo)
+
 	return result
 
 class MapData:
@@ -308,6 +311,26 @@ class MapData:
 		self.spriteindex_geo = [-1] * (self.width * self.height)
 		self.spriteindex_mg = [-1] * (self.width * self.height)
 
+		# sparse index of the above: per row, sorted columns that have a sprite
+		self.spriterows_geo = [[] for j in range(self.height)]
+		self.spriterows_mg = [[] for j in range(self.height)]
+
+	def build_spriterows(self, spriteindex):
+		result = [[] for j in range(self.height)]
+		for j in range(self.height):
+			row = result[j]
+			rowstart = j * self.width
+			for i in range(self.width):
+				if (spriteindex[rowstart + i] >= 0):
+					row.append(i)
+		return result
+
+	# columns in row y (minx <= x < maxx) that have a sprite in spriterows
+	def get_spritecols(self, spriterows, y, minx, maxx):
+		row = spriterows[y]
+		result = row[bisect_left(row, minx):bisect_left(row, maxx)]
+		return result
+
 	def get_geospriteindex(self, x, y):
 		result = self.spriteindex_geo[x + self.width * y]
 		return result
@@ -332,6 +355,7 @@ class MapData:
 
 			# add the geo sprite to the array
 			self.spriteindex_geo[x + self.width * y] = spriteindex
+			insort(self.spriterows_geo[y], x)
 			newindex = True
 			for name, index in self.spriteindexset:
 				if (index == spriteindex):
@@ -350,6 +374,8 @@ class MapData:
 			x, y = mtx*2, mty*2
 
 			# remove the geo sprite from the array
+			if (self.spriteindex_geo[x + self.width * y] >= 0):
+				self.spriterows_geo[y].remove(x)
 			self.spriteindex_geo[x + self.width * y] = -1
 
 	def get_pos2tile(self, x, y):
@@ -475,6 +501,10 @@ class MapData:
 			linenum += 1
 				
 		fin.close()
+
+		self.spriterows_geo = self.build_spriterows(self.spriteindex_geo)
+		self.spriterows_mg = self.build_spriterows(self.spriteindex_mg)
+
 		return spritebatch
 
 	'''
@@ -970,27 +1000,25 @@ def main(argv):
 
 		# draw middle ground sprites
 		for j in range(camera_miny, camera_maxy):
-			for i in range(camera_minx, camera_maxx):
+			for i in geometry.get_spritecols(geometry.spriterows_mg, j, camera_minx, camera_maxx):
 				si = geometry.get_mgspriteindex(i, j)
-				if (si >= 0):
-					rect = Rect(
-						geometry.get_tile2pos(i, j, offset=False), 
-						(TILE_WIDTH*2, TILE_WIDTH*2)
-					)
-					rect = camera.get_screenrect(rect)
-					spritebatch.draw(screen, si, rect)
+				rect = Rect(
+					geometry.get_tile2pos(i, j, offset=False), 
+					(TILE_WIDTH*2, TILE_WIDTH*2)
+				)
+				rect = camera.get_screenrect(rect)
+				spritebatch.draw(screen, si, rect)
 
 		# draw geometry sprites
 		for j in range(camera_miny, camera_maxy):
-			for i in range(camera_minx, camera_maxx):
+			for i in geometry.get_spritecols(geometry.spriterows_geo, j, camera_minx, camera_maxx):
 				si = geometry.get_geospriteindex(i, j)
-				if (si >= 0):
-					rect = Rect(
-						geometry.get_tile2pos(i, j, offset=False), 
-						(TILE_WIDTH*2, TILE_WIDTH*2)
-					)
-					rect = camera.get_screenrect(rect)
-					spritebatch.draw(screen, si, rect)
+				rect = Rect(
+					geometry.get_tile2pos(i, j, offset=False), 
+					(TILE_WIDTH*2, TILE_WIDTH*2)
+				)
+				rect = camera.get_screenrect(rect)
+				spritebatch.draw(screen, si, rect)
 
 		# draw spawn location
 		spawnpos = geometry.spawn
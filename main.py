@@ -1,8 +1,22 @@
 import pygame
 from pygame.locals import *
-from math import sqrt
+from math import sqrt, ceil
 from enum import IntEnum
+from collections import OrderedDict, deque
+from bisect import bisect_left
+from heapq import heappush, heappop
+import hashlib
 import json
+import os
+import struct
+import time
+import zlib
+
+# optional, only needed for the array physics engine
+try:
+	import numpy as np
+except ImportError:
+	np = None
 
 # constants
 # 20 feels good while being ~70 average fps for now (7/24/20)
@@ -16,7 +30,21 @@ ASPECT_RATIO_YX = 1.78
 SCREENPERCENTABOVEPLAYER = 0.60
 SCREENPERCENTFACINGDIR = 0.54
 
+# sprites
+SCALECACHE_BUDGET_BYTES = 32 * 1024 * 1024
+CHUNK_TILES = 16 # must be even so 2x2 map tiles never straddle chunks
+ATLASDATA_FILE = './data/graphics/atlasdata.json'
+
+# presentation
+PRESENT_DIRTYRECTS = False # only push changed regions to the display
+RENDER_NATIVE_RES = False # draw at game resolution, upscale once per frame
+
 # physics @ PHYSICS_TIME_STEP = 1/100
+PHYSICS_ARRAYS = False # struct-of-arrays engine, needs numpy
+SWEPT_COLLISION = False # time-of-impact collision, safe at larger time steps
+SWEEP_EPSILON = 0.000001
+SLEEP_STEPS = 30 # steps a body has to rest before it drops out of the step
+SLEEP_VEL_RANGE = 1.0
 GRAVITY_ACCEL = 64
 HORZ_FRIC_FORCE = 0.156
 VERT_FRIC_FORCE = 0.0089
@@ -31,16 +59,62 @@ JUMP_ACCEL_FORCE = 313.0
 SIDEWAYS_ACCEL = SIDEWAYS_ACCEL_FORCE * TILE_WIDTH
 JUMP_ACCEL = JUMP_ACCEL_FORCE * TILE_WIDTH
 
+# broadphase
+SPATIALHASH_CELL_TILES = 4
+
+# sight lines
+RAYCACHE_SIZE = 4096 # (origin tile, target tile) pairs kept, least recently used go first
+
+# navigation
+NAV_BODY_WIDTH = 3 # boars
+NAV_BODY_HEIGHT = 3
+NAV_MAX_DROP = 12 # furthest down a jump edge lands, in tiles. drops go any distance
+NAV_JUMP_MAXSTEPS = 1000
+NAV_JUMP_COST = 2.0
+NAV_DROP_COST = 0.5 # per tile fallen
+NAV_EXPANSIONS_PER_FRAME = 400
+NAV_PATHCACHE_SIZE = 256 # found paths kept, least recently used go first
+
+# particles
+PARTICLE_CAPACITY = 256 # starting pool, doubles when full
+PARTICLE_SIZE = 4
+PARTICLE_GRAVITY = GRAVITY_ACCEL * TILE_WIDTH
+
+# simulation lod, in tiles outside the camera's view
+SIM_LOD = False # only for update_physicsbodies, the array engine steps everything
+LOD_FULL_TILES = 4
+LOD_COARSE_TILES = 24 # further than this is frozen
+LOD_COARSE_STEPS = 5
+
+# ai
+AI_THINK_HZ = 15
+AI_FRAME_BUDGET_SEC = 0.002
+
+# combat
+LIGHT_ATTACK_SEC = 0.15 # swing length, run down on the attacker's attack_timer
+HEAVY_ATTACK_SEC = 0.3
+LIGHT_ATTACK_REACH = 2 # in tiles, out in front of the attacker
+HEAVY_ATTACK_REACH = 3
+LIGHT_ATTACK_KNOCKBACK = 15.0 # tiles per second added to the target's velocity
+HEAVY_ATTACK_KNOCKBACK = 30.0
+
+# entities
+ENTITYID_SLOTBITS = 16 # entity id = (generation << ENTITYID_SLOTBITS) | slot
+
+# replay
+REPLAY_KEYFRAME_STEPS = 500
+
 # input constants
 MAXINPUTQUEUELEN = 10
 HOLDBUTTONTIMESHORT = 10 * 1/60.0
 JUMP_COOLDOWN_SEC = 0.2
+COMBO_STEP_FRAMES = 15 # most frames between one step of a combo and the next
 
 # fudge factors
 VEL_CLAMTOZERO_RANGE = 5.0
 RECT_FAT_MOD = 1.05
 
-COYOTE_FRAMES = 5
+COYOTE_SEC = 0.05 # falling off a ledge this long still leaves the ground jump
 EARLYJUMP_FRAMES = 8
 
 # magic
@@ -53,7 +127,8 @@ E_SUN = 5
 E_LIFE = 6
 E_BLOOD = 7
 
-# debug tiles
+# debug tiles, collected by resolve_geocollision and drawn by main()
+DEBUG_HIGHLIGHT = False
 highlight = []
 
 def sign(n):
@@ -117,6 +192,8 @@ def tuple_mult(tup, scalar):
 	return (resultx, resulty)
 
 class Rect:
+	__slots__ = ('x', 'y', 'width', 'height')
+
 	def __init__(self, pos, dim):
 		self.x = pos[0]
 		self.y = pos[1]
@@ -177,13 +254,19 @@ class Rect:
 		)
 		return result
 
+	# rect's center inside self grown by half of rect on every side, same
+	# test as contains_point but without making the grown rect
 	def collides_rect(self, rect):
-		sum_rect = Rect(
-			(self.x-rect.width/2.0, self.y-rect.height/2.0), 
-			(self.width+rect.width, self.height+rect.height)
+		sumx = self.x-rect.width/2.0
+		sumy = self.y-rect.height/2.0
+		centerx = rect.x + rect.width/2.0
+		centery = rect.y + rect.height/2.0
+		result = (
+			centerx > sumx and
+			centerx < sumx + (self.width+rect.width) and
+			centery > sumy and
+			centery < sumy + (self.height+rect.height)
 		)
-		point = rect.get_center()
-		result = sum_rect.contains_point(point)
 		return result
 
 	def contains_rect(self, rect):
@@ -204,10 +287,33 @@ red = pygame.Color('red')
 black = pygame.Color('black')
 
 spell_elements = [E_WATER, E_FIRE, E_WIND]
+element_colors = {E_WATER : lightblue, E_FIRE : lightred, E_WIND : lightgreen}
 
 class Camera:
-	def __init__(self, pos, screendim):
+	def __init__(self, pos, screendim, nativerender=RENDER_NATIVE_RES):
+
+		width, height = self.fit_window(screendim)
+
+		# gamepixels * zoom = screenpixels
+		self.zoom = self.width / screendim[0]
+
+		# game dim
+		self.game_width = width / self.zoom
+		self.game_height = height / self.zoom
+
+		# when drawing at native game resolution, everything is drawn unzoomed
+		# onto an offscreen target that gets scaled up to the screen once
+		self.nativerender = nativerender
+		self.renderzoom = self.zoom
+		if (self.nativerender):
+			self.renderzoom = 1.0
+
+		# game pos
+		self.pos = (
+			pos[0] - int(self.game_width*SCREENPERCENTFACINGDIR), 
+			pos[1] - int(self.game_height*SCREENPERCENTABOVEPLAYER))
 
+	def fit_window(self, screendim):
 		width = 0
 		height = 0
 		x_off = 0
@@ -231,17 +337,7 @@ class Camera:
 		# only used to draw camera screen onto parent screen
 		self.screenoffset = (int(x_off), int(y_off))
 
-		# gamepixels * zoom = screenpixels
-		self.zoom = self.width / screendim[0]
-
-		# game dim
-		self.game_width = width / self.zoom
-		self.game_height = height / self.zoom
-
-		# game pos
-		self.pos = (
-			pos[0] - int(self.game_width*SCREENPERCENTFACINGDIR), 
-			pos[1] - int(self.game_height*SCREENPERCENTABOVEPLAYER))
+		return (width, height)
 
 	def update_pos(self, playerphysics):
 		prevpos = self.pos
@@ -306,8 +402,8 @@ class Camera:
 		ypos = y - self.pos[1]
 
 		result = (
-			int(xpos * self.zoom + 0.5),
-			int(ypos * self.zoom + 0.5)
+			int(xpos * self.renderzoom + 0.5),
+			int(ypos * self.renderzoom + 0.5)
 		)
 
 		return result
@@ -316,8 +412,8 @@ class Camera:
 		result = Rect(
 			self.game2screen(rect.x, rect.y),
 			(
-				int(rect.width * self.zoom),
-				int(rect.height * self.zoom)
+				int(rect.width * self.renderzoom),
+				int(rect.height * self.renderzoom)
 			)
 		)
 		return result
@@ -341,23 +437,53 @@ class Camera:
 
 		return result
 
+	def get_rendertarget(self, camerascreen):
+		result = camerascreen
+		if (self.nativerender):
+			result = pygame.Surface((ceil(self.game_width), ceil(self.game_height)))
+		return result
+
+	def upscale_rendertarget(self, rendertarget, camerascreen):
+		if (rendertarget is camerascreen):
+			return
+
+		targetw, targeth = rendertarget.get_size()
+		dim = (self.width, self.height)
+
+		if (dim == (targetw, targeth)):
+			camerascreen.blit(rendertarget, (0, 0))
+		elif (dim == (targetw*2, targeth*2)):
+			pygame.transform.scale2x(rendertarget, camerascreen)
+		else:
+			pygame.transform.scale(rendertarget, dim, camerascreen)
+
 	def update_window(self):
+		# game dims stay the same, so only the screen size and zoom change
 		surface = pygame.display.get_surface()
-		x, y = size = surface.get_width(), surface.get_height()
-		if (x < y):
-			width = x
-			height = width*ASPECT_RATIO_XY
-		else:
-			height = y
-			width = height//ASPECT_RATIO_XY
-		self.width = width
-		self.height = height
+		self.fit_window((surface.get_width(), surface.get_height()))
+		self.zoom = self.width / self.game_width
+		if (not self.nativerender):
+			self.renderzoom = self.zoom
 
 class MapData:
 	def __init__(self):
 		self.width = 0
 		self.height = 0
-		self.geo = [False] * (self.width * self.height)
+		# collision grid, one int per row used as a bitset: bit x set = solid.
+		# anything off the map counts as empty.
+		self.georows = [0] * self.height
+		# georows greedy-merged into as few rects as possible (in tiles), and
+		# for every tile the index of the one covering it (-1 if empty).
+		# rebuilt lazily after set_geo.
+		self.georects = None
+		self.georectgrid = None
+		# filled in by get_georectsfromrect and reused, so the physics step
+		# doesn't make rects or lists
+		self.georectscratch = []
+		self.georectindices = []
+		self.geogrid = None # numpy bool array for raycast_many, also rebuilt lazily
+		self.geoversion = 0 # bumped by set_geo, wakes sleeping bodies
+		self.raycache = OrderedDict() # (origintile, targettile) -> line of sight, least recently used first
 		self.spawn = (0, 0) # bottom left!! of spawn loc
 
 		# Since tile = 2x2, these will both be at least 3/4th empty. 
@@ -366,6 +492,26 @@ class MapData:
 		self.spriteindex_geo = [-1] * (self.width * self.height)
 		self.spriteindex_mg = [-1] * (self.width * self.height)
 
+		# sparse index of the above: per row, sorted columns that have a sprite
+		self.spriterows_geo = [[] for j in range(self.height)]
+		self.spriterows_mg = [[] for j in range(self.height)]
+
+	def build_spriterows(self, spriteindex):
+		result = [[] for j in range(self.height)]
+		for j in range(self.height):
+			row = result[j]
+			rowstart = j * self.width
+			for i in range(self.width):
+				if (spriteindex[rowstart + i] >= 0):
+					row.append(i)
+		return result
+
+	# columns in row y (minx <= x < maxx) that have a sprite in spriterows
+	def get_spritecols(self, spriterows, y, minx, maxx):
+		row = spriterows[y]
+		result = row[bisect_left(row, minx):bisect_left(row, maxx)]
+		return result
+
 	def get_geospriteindex(self, x, y):
 		result = self.spriteindex_geo[x + self.width * y]
 		return result
@@ -375,7 +521,311 @@ class MapData:
 		return result
 
 	def get_geo(self, x, y):
-		result = self.geo[x + self.width * y]
+		result = False
+		if (x >= 0 and y >= 0 and x < self.width and y < self.height):
+			result = ((self.georows[y] >> x) & 1 == 1)
+		return result
+
+	def set_geo(self, x, y, solid):
+		if (solid):
+			self.georows[y] |= (1 << x)
+		else:
+			self.georows[y] &= ~(1 << x)
+		self.georects = None
+		self.geogrid = None
+		self.geoversion += 1
+		# sight lines only depend on the map, so this is the only time they change
+		self.raycache.clear()
+
+	def build_georects(self):
+		# greedy meshing: take the widest run of solid tiles left in a row,
+		# then grow it down for as long as the rows below have the whole run
+		remaining = list(self.georows)
+		self.georects = []
+		self.georectgrid = [[-1]*self.width for j in range(self.height)]
+		for j in range(self.height):
+			while (remaining[j]):
+				bits = remaining[j]
+				x = (bits & -bits).bit_length() - 1
+				# run of set bits starting at x
+				width = ((~(bits >> x)) & ((bits >> x) + 1)).bit_length() - 1
+				mask = ((1 << width) - 1) << x
+
+				height = 1
+				while (j+height < self.height and remaining[j+height] & mask == mask):
+					remaining[j+height] &= ~mask
+					height += 1
+				remaining[j] &= ~mask
+
+				for row in self.georectgrid[j:j+height]:
+					row[x:x+width] = [len(self.georects)]*width
+				self.georects.append((x, j, width, height))
+
+	def get_tilebounds(self, rect):
+		# inclusive tile range a rect touches, clamped to the map. clamped with
+		# ifs, the physics step calls this per body and max() makes a tuple
+		minx, miny = self.get_pos2tile(rect.x, rect.y)
+		maxx, maxy = self.get_pos2tile(rect.x+rect.width, rect.y+rect.height)
+		if (minx < 0):
+			minx = 0
+		if (miny < 0):
+			miny = 0
+		if (maxx > self.width-1):
+			maxx = self.width-1
+		if (maxy > self.height-1):
+			maxy = self.height-1
+		result = (minx, miny, maxx, maxy)
+		return result
+
+	def any_geoinrect(self, rect):
+		result = self.any_geointiles(*self.get_tilebounds(rect))
+		return result
+
+	# bit i of each row = tile (minx+i, y), rows from miny to maxy
+	def get_geomaskfromrect(self, rect):
+		minx, miny, maxx, maxy = self.get_tilebounds(rect)
+		result = []
+		if (minx <= maxx):
+			mask = (1 << (maxx-minx+1)) - 1
+			for j in range(miny, maxy+1):
+				result.append((self.georows[j] >> minx) & mask)
+		return result
+
+	# first solid tile in row y going from fromx to tox (either way), or -1
+	def get_firstgeoinrow(self, y, fromx, tox):
+		result = self.get_firstgeocol(fromx, tox, y, y)
+		return result
+
+	# first column from fromx to tox (either way) with a solid tile in any of
+	# rows miny to maxy, or -1
+	def get_firstgeocol(self, fromx, tox, miny, maxy):
+		minx = max(min(fromx, tox), 0)
+		maxx = min(max(fromx, tox), self.width-1)
+		miny = max(miny, 0)
+		maxy = min(maxy, self.height-1)
+		if (minx > maxx or miny > maxy):
+			return -1
+
+		bits = 0
+		georows = self.georows
+		for j in range(miny, maxy+1):
+			bits |= georows[j]
+		bits &= ((1 << (maxx-minx+1)) - 1) << minx
+		if (bits == 0):
+			return -1
+
+		if (fromx <= tox):
+			# lowest set bit
+			result = (bits & -bits).bit_length() - 1
+		else:
+			# highest set bit
+			result = bits.bit_length() - 1
+		return result
+
+	# first row from fromy to toy (either way) with a solid tile in any of
+	# columns minx to maxx, or -1
+	def get_firstgeorow(self, fromy, toy, minx, maxx):
+		minx = max(minx, 0)
+		maxx = min(maxx, self.width-1)
+		miny = max(min(fromy, toy), 0)
+		maxy = min(max(fromy, toy), self.height-1)
+		if (minx > maxx or miny > maxy):
+			return -1
+
+		rows = range(miny, maxy+1)
+		if (toy < fromy):
+			rows = range(maxy, miny-1, -1)
+
+		mask = ((1 << (maxx-minx+1)) - 1) << minx
+		georows = self.georows
+		for j in rows:
+			if (georows[j] & mask):
+				return j
+		return -1
+
+	# first solid tile in column x going from fromy to toy (either way), or -1
+	def get_firstgeoincol(self, x, fromy, toy):
+		result = self.get_firstgeorow(fromy, toy, x, x)
+		return result
+
+	# anything solid in the inclusive tile range (clamped to the map)
+	def any_geointiles(self, minx, miny, maxx, maxy):
+		minx = max(minx, 0)
+		miny = max(miny, 0)
+		maxx = min(maxx, self.width-1)
+		maxy = min(maxy, self.height-1)
+		if (minx > maxx):
+			return False
+
+		mask = ((1 << (maxx-minx+1)) - 1) << minx
+		georows = self.georows
+		for j in range(miny, maxy+1):
+			if (georows[j] & mask):
+				return True
+		return False
+
+	'''
+	Amanatides-Woo traversal of the tiles the segment from world point (x0, y0)
+	to (x1, y1) passes through, in order. Returns the first solid tile as
+	(x, y), or None if the whole segment is clear.
+
+	Rays that stay in one row or column are a single bitset lookup, and rays
+	whose bounding box of tiles is empty never get walked.
+	'''
+	def raycast(self, x0, y0, x1, y1):
+		tx, ty = self.get_pos2tile(x0, y0)
+		endx, endy = self.get_pos2tile(x1, y1)
+
+		if (ty == endy):
+			hit = self.get_firstgeoinrow(ty, tx, endx)
+			result = None
+			if (hit >= 0):
+				result = (hit, ty)
+			return result
+		if (tx == endx):
+			hit = self.get_firstgeoincol(tx, ty, endy)
+			result = None
+			if (hit >= 0):
+				result = (tx, hit)
+			return result
+
+		if (not self.any_geointiles(min(tx, endx), min(ty, endy), max(tx, endx), max(ty, endy))):
+			return None
+
+		# t is the fraction of the segment travelled. tmax is t at the next
+		# tile boundary on each axis, tdelta is t per whole tile.
+		dx = x1 - x0
+		dy = y1 - y0
+		stepx = sign(dx)
+		stepy = sign(dy)
+		tdeltax = TILE_WIDTH / abs(dx)
+		tdeltay = TILE_WIDTH / abs(dy)
+		if (stepx > 0):
+			tmaxx = ((tx+1)*TILE_WIDTH - x0) / dx
+		else:
+			tmaxx = (tx*TILE_WIDTH - x0) / dx
+		if (stepy > 0):
+			tmaxy = ((ty+1)*TILE_WIDTH - y0) / dy
+		else:
+			tmaxy = (ty*TILE_WIDTH - y0) / dy
+
+		georows = self.georows
+		width = self.width
+		height = self.height
+		# one tile per boundary crossed, so rounding can't walk past the end
+		for i in range(abs(endx-tx) + abs(endy-ty) + 1):
+			if (tx >= 0 and ty >= 0 and tx < width and ty < height and
+				(georows[ty] >> tx) & 1):
+				return (tx, ty)
+
+			if (tmaxx < tmaxy):
+				tmaxx += tdeltax
+				tx += stepx
+			else:
+				tmaxy += tdeltay
+				ty += stepy
+
+		return None
+
+	'''
+	raycast() for every ray as (x0, y0, x1, y1), results in the same order.
+	With numpy, all the rays take their traversal steps together: each pass
+	looks up the current tile of every ray still going in the collision grid,
+	then moves each of them on by one tile, so the python loop runs once per
+	tile of the longest ray rather than once per tile of every ray.
+	'''
+	def raycast_many(self, rays):
+		if (np is None):
+			result = []
+			for x0, y0, x1, y1 in rays:
+				result.append(self.raycast(x0, y0, x1, y1))
+			return result
+
+		if (self.geogrid is None):
+			self.geogrid = get_geogrid(self)
+		geogrid = self.geogrid
+
+		rays = np.asarray(rays, dtype=float).reshape(-1, 4)
+		x0, y0, x1, y1 = rays[:, 0], rays[:, 1], rays[:, 2], rays[:, 3]
+		tx = (x0 // TILE_WIDTH).astype(np.int64)
+		ty = (y0 // TILE_WIDTH).astype(np.int64)
+		endx = (x1 // TILE_WIDTH).astype(np.int64)
+		endy = (y1 // TILE_WIDTH).astype(np.int64)
+
+		# same as raycast(), with an infinite tmax on an axis a ray doesn't move along
+		dx = x1 - x0
+		dy = y1 - y0
+		stepx = np.sign(dx).astype(np.int64)
+		stepy = np.sign(dy).astype(np.int64)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			tdeltax = TILE_WIDTH / np.abs(dx)
+			tdeltay = TILE_WIDTH / np.abs(dy)
+			tmaxx = np.where(stepx > 0, (tx+1)*TILE_WIDTH - x0, tx*TILE_WIDTH - x0) / dx
+			tmaxy = np.where(stepy > 0, (ty+1)*TILE_WIDTH - y0, ty*TILE_WIDTH - y0) / dy
+		tmaxx[dx == 0] = np.inf
+		tmaxy[dy == 0] = np.inf
+
+		numsteps = np.abs(endx-tx) + np.abs(endy-ty) + 1
+		hitx = np.full(len(rays), -1, dtype=np.int64)
+		hity = np.full(len(rays), -1, dtype=np.int64)
+		live = np.arange(len(rays))
+		i = 0
+		while (len(live) > 0):
+			live = live[numsteps[live] > i]
+			lx = tx[live]
+			ly = ty[live]
+			onmap = (lx >= 0) & (ly >= 0) & (lx < self.width) & (ly < self.height)
+			solid = np.zeros(len(live), dtype=bool)
+			solid[onmap] = geogrid[ly[onmap], lx[onmap]]
+			hitx[live[solid]] = lx[solid]
+			hity[live[solid]] = ly[solid]
+			live = live[~solid]
+
+			movex = (tmaxx[live] < tmaxy[live])
+			xs = live[movex]
+			ys = live[~movex]
+			tmaxx[xs] += tdeltax[xs]
+			tx[xs] += stepx[xs]
+			tmaxy[ys] += tdeltay[ys]
+			ty[ys] += stepy[ys]
+			i += 1
+
+		result = []
+		for x, y in zip(hitx.tolist(), hity.tolist()):
+			if (x < 0):
+				result.append(None)
+			else:
+				result.append((x, y))
+		return result
+
+	'''
+	Line of sight from the center of one tile to the center of another,
+	cached by (origintile, targettile). Sight lines between tiles only depend
+	on the map, so they're good until set_geo changes it, but only the last
+	RAYCACHE_SIZE pairs asked about are kept. Enemies in the same tile looking
+	at the same target share one raycast.
+	'''
+	def get_lineofsight(self, origintile, targettile):
+		key = (origintile, targettile)
+		result = self.raycache.get(key)
+		if (result is None):
+			x0, y0 = self.get_tile2pos(*origintile)
+			x1, y1 = self.get_tile2pos(*targettile)
+			result = (self.raycast(x0, y0, x1, y1) is None)
+			self.raycache[key] = result
+			# evict least recently asked for sight lines
+			while (len(self.raycache) > RAYCACHE_SIZE):
+				self.raycache.popitem(last=False)
+		else:
+			self.raycache.move_to_end(key)
+		return result
+
+	# line of sight from each world point in origins to the world point target
+	def get_lineofsight_many(self, origins, target):
+		targettile = self.get_pos2tile(*target)
+		result = []
+		for origin in origins:
+			result.append(self.get_lineofsight(self.get_pos2tile(*origin), targettile))
 		return result
 
 	def get_pos2tile(self, x, y):
@@ -398,19 +848,82 @@ class MapData:
 			(y+TILE_WIDTH/2)//TILE_WIDTH*TILE_WIDTH)
 		return result
 
-	# only returns geometry (in world coord's) that is solid (i.e. True in MapData.geo)
+	# only returns geometry (in world coord's) that is solid (i.e. set in MapData.georows)
 	def get_tilesfromrect(self, rect):
-		minx, miny = self.get_pos2tile(rect.x, rect.y)
-		maxx, maxy = self.get_pos2tile(rect.x+rect.width, rect.y+rect.height)
+		minx, miny, maxx, maxy = self.get_tilebounds(rect)
+		georows = self.georows
 
 		result = []
 		for i in range(minx, maxx+1):
 			for j in range(miny, maxy+1):
-				if self.get_geo(i, j):
+				if ((georows[j] >> i) & 1):
 					newtile = Rect((i*TILE_WIDTH, j*TILE_WIDTH), (TILE_WIDTH, TILE_WIDTH))
 					result.append(newtile)
 		return result
 
+	'''
+	Same area as get_tilesfromrect, but as merged rects cut down to the tiles
+	the rect touches, so a long floor comes back as one rect. They're written
+	into self.georectscratch, in the order the georects were built in, and
+	the result is how many there are (0 if the rect touches no geometry): the
+	physics step calls this for every body, so it reuses the same rects and
+	sticks to while loops and ifs, which don't allocate.
+	'''
+	def get_georectsfromrect(self, rect):
+		if (self.georects is None):
+			self.build_georects()
+
+		minx, miny, maxx, maxy = self.get_tilebounds(rect)
+		georects = self.georects
+		indices = self.georectindices
+		result = 0
+		j = miny
+		while (j <= maxy):
+			row = self.georectgrid[j]
+			i = minx
+			while (i <= maxx):
+				ri = row[i]
+				if (ri >= 0):
+					x, y, width, height = georects[ri]
+					# each georect once, at the first of its tiles in range
+					if ((i == x or i == minx) and (j == y or j == miny)):
+						if (result == len(indices)):
+							indices.append(ri)
+						# insertion sort, there are only ever a few
+						k = result
+						while (k > 0 and indices[k-1] > ri):
+							indices[k] = indices[k-1]
+							k -= 1
+						indices[k] = ri
+						result += 1
+				i += 1
+			j += 1
+
+		scratch = self.georectscratch
+		k = 0
+		while (k < result):
+			left, top, width, height = georects[indices[k]]
+			right = left+width-1
+			bottom = top+height-1
+			if (left < minx):
+				left = minx
+			if (top < miny):
+				top = miny
+			if (right > maxx):
+				right = maxx
+			if (bottom > maxy):
+				bottom = maxy
+			if (k == len(scratch)):
+				scratch.append(Rect((0, 0), (0, 0)))
+			# as floats, ints past 256 would each be a new object
+			tile = scratch[k]
+			tile.x = float(left)*TILE_WIDTH
+			tile.y = float(top)*TILE_WIDTH
+			tile.width = float(right-left+1)*TILE_WIDTH
+			tile.height = float(bottom-top+1)*TILE_WIDTH
+			k += 1
+		return result
+
 	def get_spawn(self):
 		location = (self.spawn[0], self.spawn[1])
 		result = self.get_tile2pos(*location, offset=False)
@@ -439,7 +952,7 @@ class MapData:
 				self.width = width
 				self.height = height
 
-				self.geo = [False] * (width * height)
+				self.georows = [0] * height
 				self.spriteindex_geo = [-1] * (width * height)
 				self.spriteindex_mg = [-1] * (width * height)
 			elif (loadphase == 1):
@@ -466,15 +979,11 @@ class MapData:
 						spriteindex = spriteindextranslator[int(char)]
 						self.spriteindex_geo[linenum*2 * self.width + colnum] = spriteindex
 						# set geometry
-						self.geo[linenum * 2 * self.width + colnum] = True
-						self.geo[linenum * 2 * self.width + colnum + 1] = True
-						self.geo[(linenum * 2 + 1) * self.width + colnum] = True
-						self.geo[(linenum * 2 + 1) * self.width + colnum + 1] = True
+						self.georows[linenum * 2] |= (3 << colnum)
+						self.georows[linenum * 2 + 1] |= (3 << colnum)
 					else:
-						self.geo[linenum * 2 * self.width + colnum] = False
-						self.geo[linenum * 2 * self.width + colnum + 1] = False
-						self.geo[(linenum * 2 + 1) * self.width + colnum] = False
-						self.geo[(linenum * 2 + 1) * self.width + colnum + 1] = False
+						self.georows[linenum * 2] &= ~(3 << colnum)
+						self.georows[linenum * 2 + 1] &= ~(3 << colnum)
 
 					colnum += 2
 
@@ -489,40 +998,882 @@ class MapData:
 						spriteindex = spriteindextranslator[int(char)]
 						gridindex = linenum*2 * self.width + colnum
 						# don't draw midground behind geometry (can't see it anyway)
-						if (not self.geo[gridindex]):
+						if (not self.get_geo(colnum, linenum*2)):
 							self.spriteindex_mg[gridindex] = spriteindex
 					colnum += 2
 			
 			linenum += 1
 				
 		fin.close()
+
+		self.spriterows_geo = self.build_spriterows(self.spriteindex_geo)
+		self.spriterows_mg = self.build_spriterows(self.spriteindex_mg)
+		self.build_georects()
+
 		return spritebatch
 
-def update_physicsbodies(entities, numentities, geometry):
-	# get all new rects by moving them and reconciling with collisions
+'''
+Map layers are baked into CHUNK_TILES x CHUNK_TILES surfaces (already zoomed),
+so drawing the map is a handful of big blits instead of one per tile.
+Geometry never changes at runtime, so chunks are only rebuilt on zoom change.
 
-	# first, try assuming zero collisions and just move in direction of velocity
-	new_rects = []
-	for e in entities:
+Chunks are opaque and start out filled with the clear color, because alpha
+blending onto a transparent surface doesn't come out the same as blending
+straight onto the screen. Midground and geometry go into the same chunk.
+'''
+class ChunkRenderer:
+	def __init__(self, geometry, spritebatch, clearcolor):
+		self.geometry = geometry
+		self.spritebatch = spritebatch
+		self.clearcolor = clearcolor
+
+		self.chunkswide = ceil(geometry.width / CHUNK_TILES)
+		self.chunkshigh = ceil(geometry.height / CHUNK_TILES)
+
+		# zoom the chunks were baked at
+		self.zoom = None
+		# flat list of chunk surfaces, None = nothing in it
+		self.chunks = []
+
+	def build(self, zoom):
+		self.zoom = zoom
+		self.spritebatch.set_zoom(zoom)
+
+		# back to front
+		layers = [
+			(self.geometry.spriterows_mg, self.geometry.spriteindex_mg),
+			(self.geometry.spriterows_geo, self.geometry.spriteindex_geo)
+		]
+
+		self.chunks = []
+		for cj in range(self.chunkshigh):
+			for ci in range(self.chunkswide):
+				self.chunks.append(self.build_chunk(ci, cj, layers))
+
+	def build_chunk(self, ci, cj, layers):
+		geometry = self.geometry
+		zoom = self.zoom
+		chunkdim = int(CHUNK_TILES*TILE_WIDTH*zoom + 0.5)
+		spritedim = (int(TILE_WIDTH*2*zoom), int(TILE_WIDTH*2*zoom))
+
+		minx = ci*CHUNK_TILES
+		miny = cj*CHUNK_TILES
+		maxx = min(minx + CHUNK_TILES, geometry.width)
+		maxy = min(miny + CHUNK_TILES, geometry.height)
+
+		blitlist = []
+		for spriterows, spriteindex in layers:
+			for j in range(miny, maxy):
+				for i in geometry.get_spritecols(spriterows, j, minx, maxx):
+					si = spriteindex[i + geometry.width * j]
+					rect = Rect(
+						(
+							int((i-minx)*TILE_WIDTH*zoom + 0.5),
+							int((j-miny)*TILE_WIDTH*zoom + 0.5)
+						),
+						spritedim
+					)
+					blitlist.append(self.spritebatch.draw(si, rect))
+
+		result = None
+		if (len(blitlist) > 0):
+			result = pygame.Surface((chunkdim, chunkdim))
+			result.fill(self.clearcolor)
+			result.blits(blitlist, doreturn=False)
+		return result
+
+	def draw(self, screen, camera):
+		if (camera.renderzoom != self.zoom):
+			self.build(camera.renderzoom)
+
+		chunkwidth = CHUNK_TILES*TILE_WIDTH
+		minci = max(int(camera.pos[0]//chunkwidth), 0)
+		mincj = max(int(camera.pos[1]//chunkwidth), 0)
+		maxci = min(int((camera.pos[0]+camera.game_width)//chunkwidth), self.chunkswide-1)
+		maxcj = min(int((camera.pos[1]+camera.game_height)//chunkwidth), self.chunkshigh-1)
+
+		blitlist = []
+		for cj in range(mincj, maxcj+1):
+			for ci in range(minci, maxci+1):
+				chunk = self.chunks[ci + cj*self.chunkswide]
+				if (not chunk is None):
+					blitlist.append((chunk, camera.game2screen(ci*chunkwidth, cj*chunkwidth)))
+		screen.blits(blitlist, doreturn=False)
+
+'''
+With dirtyrects enabled, a frame where the camera didn't move only restores
+the map under last frame's rects, redraws on top, and pushes just those rects
+to the display. Any camera movement shifts the whole screen, so that (and the
+disabled mode) falls back to a full redraw and flip.
+'''
+class DirtyRectPresenter:
+	def __init__(self, screenoffset, enabled=PRESENT_DIRTYRECTS):
+		# rects are in camera screen coords, display.update wants window coords
+		self.screenoffset = screenoffset
+		self.enabled = enabled
+
+		self.campos = None
+		self.fullredraw = True
+
+		self.prevrects = [] # drawn last frame, need the background put back
+		self.currrects = [] # drawn this frame
+
+	def begin(self, camera):
+		self.fullredraw = (not self.enabled or camera.pos != self.campos)
+		self.campos = camera.pos
+		result = self.fullredraw
+		return result
+
+	def reset(self, screenoffset):
+		self.screenoffset = screenoffset
+		self.campos = None
+
+	def get_stalerects(self):
+		result = self.prevrects
+		return result
+
+	def add(self, rect):
+		self.currrects.append(rect)
+
+	def present(self):
+		if (self.fullredraw):
+			pygame.display.flip()
+		else:
+			rects = []
+			for rect in self.prevrects:
+				rects.append(rect.move(self.screenoffset))
+			for rect in self.currrects:
+				rects.append(rect.move(self.screenoffset))
+			pygame.display.update(rects)
+
+		self.prevrects = self.currrects
+		self.currrects = []
+
+'''
+Uniform grid broadphase for bodies, hitboxes and AI queries. Cells are
+SPATIALHASH_CELL_TILES*TILE_WIDTH wide. Every item remembers the cell range it
+was put in, so update() only touches the hash when an item crosses a cell
+boundary. Queries check actual rect overlap before returning anything.
+'''
+class SpatialHash:
+	def __init__(self, celltiles=SPATIALHASH_CELL_TILES):
+		self.cellwidth = celltiles*TILE_WIDTH
+		self.cells = {} # (cx, cy) -> set of items
+		self.rects = {} # item -> rect
+		self.cellbounds = {} # item -> (mincx, mincy, maxcx, maxcy)
+		self.order = {} # item -> insertion number, for ordering pairs
+		self.numinserted = 0
+
+	def get_cellbounds(self, rect):
+		cw = self.cellwidth
+		result = (
+			int(rect.x//cw), int(rect.y//cw),
+			int((rect.x+rect.width)//cw), int((rect.y+rect.height)//cw))
+		return result
+
+	def add_tocells(self, item, bounds):
+		mincx, mincy, maxcx, maxcy = bounds
+		for cy in range(mincy, maxcy+1):
+			for cx in range(mincx, maxcx+1):
+				cell = self.cells.get((cx, cy))
+				if (cell is None):
+					cell = set()
+					self.cells[(cx, cy)] = cell
+				cell.add(item)
+
+	def remove_fromcells(self, item, bounds):
+		mincx, mincy, maxcx, maxcy = bounds
+		for cy in range(mincy, maxcy+1):
+			for cx in range(mincx, maxcx+1):
+				cell = self.cells[(cx, cy)]
+				cell.discard(item)
+				if (len(cell) == 0):
+					del self.cells[(cx, cy)]
+
+	def insert(self, item, rect):
+		bounds = self.get_cellbounds(rect)
+		self.rects[item] = rect.copy()
+		self.cellbounds[item] = bounds
+		self.order[item] = self.numinserted
+		self.numinserted += 1
+		self.add_tocells(item, bounds)
+
+	def update(self, item, rect):
+		itemrect = self.rects[item]
+		itemrect.x = rect.x
+		itemrect.y = rect.y
+		itemrect.width = rect.width
+		itemrect.height = rect.height
+
+		bounds = self.get_cellbounds(rect)
+		oldbounds = self.cellbounds[item]
+		if (bounds != oldbounds):
+			self.remove_fromcells(item, oldbounds)
+			self.add_tocells(item, bounds)
+			self.cellbounds[item] = bounds
+
+	def remove(self, item):
+		self.remove_fromcells(item, self.cellbounds[item])
+		del self.rects[item]
+		del self.cellbounds[item]
+		del self.order[item]
+
+	def has(self, item):
+		result = (item in self.rects)
+		return result
+
+	def get_rect(self, item):
+		result = self.rects[item]
+		return result
+
+	def query_rect(self, rect, exclude=None):
+		mincx, mincy, maxcx, maxcy = self.get_cellbounds(rect)
+		seen = set()
+		result = []
+		for cy in range(mincy, maxcy+1):
+			for cx in range(mincx, maxcx+1):
+				cell = self.cells.get((cx, cy))
+				if (cell is None):
+					continue
+				for item in cell:
+					if (item in seen or item is exclude):
+						continue
+					seen.add(item)
+					if (self.rects[item].collides_rect(rect)):
+						result.append(item)
+		return result
+
+	def query_point(self, point):
+		cw = self.cellwidth
+		cell = self.cells.get((int(point[0]//cw), int(point[1]//cw)))
+		result = []
+		if (not cell is None):
+			for item in cell:
+				if (self.rects[item].contains_point(point)):
+					result.append(item)
+		return result
+
+	def find_pairs(self):
+		# every overlapping pair once, (earlier inserted, later inserted)
+		order = self.order
+		seen = set()
+		result = []
+		for cell in self.cells.values():
+			if (len(cell) < 2):
+				continue
+			items = sorted(cell, key=order.get)
+			for ai in range(len(items)):
+				a = items[ai]
+				arect = self.rects[a]
+				for bi in range(ai+1, len(items)):
+					b = items[bi]
+					key = (order[a], order[b])
+					if (key in seen):
+						continue
+					seen.add(key)
+					if (arect.collides_rect(self.rects[b])):
+						result.append((a, b))
+		return result
+
+class NavEdge(IntEnum):
+	WALK = 0
+	DROP = 1
+	JUMP = 2
+
+'''
+Platformer navigation graph for one body size, built from MapData's collision
+rows. A node (x, y) is a spot the body can stand: its left column is x, its
+feet are in row y, it fits there, and there's something solid under it.
+
+Edges:
+	WALK: to the node one column over on the same row
+	DROP: step off a ledge one column over and fall straight down
+	JUMP: anywhere the jump arc reaches, as simulated with the same forces
+		player_update and player_handleinput apply (gravity, drag, jump
+		impulse, holding a direction). The arc is checked for clearance as
+		straight up then across when jumping up, across then down when
+		jumping down.
+
+Pathfinding is A* that runs in slices. request_path() queues a request (or
+hands back a finished/queued one for the same start and goal) and update()
+expands at most a budget of nodes per frame across all queued requests,
+carrying on where it left off next frame. Only queued requests and found
+paths are kept: the last NAV_PATHCACHE_SIZE found paths are cached until the
+map changes, and a failed search is dropped once it finishes, so asking again
+searches again.
+'''
+class NavGraph:
+	def __init__(self, geometry, bodywidth=NAV_BODY_WIDTH, bodyheight=NAV_BODY_HEIGHT):
+		self.geometry = geometry
+		self.bodywidth = bodywidth
+		self.bodyheight = bodyheight
+
+		self.jumpreach = self.build_jumpreach()
+
+		self.pending = deque()
+		self.requests = {} # (start, goal) -> queued PathRequest
+		self.paths = OrderedDict() # (start, goal) -> found PathRequest, least recently used first
+		self.build()
+
+	'''
+	Simulates a jump while holding a direction and returns, for every rise in
+	tiles (negative is landing lower), how many tiles across the body can get
+	while still being at least that high.
+	'''
+	def build_jumpreach(self):
+		x = 0.0
+		y = 0.0
+		dpx = 0.0
+		dpy = 0.0
+		heights = []
+		while (y < NAV_MAX_DROP*TILE_WIDTH and len(heights) < NAV_JUMP_MAXSTEPS):
+			forcex = SIDEWAYS_ACCEL - sign(dpx)*(dpx**2)*HORZ_FRIC
+			forcey = GRAVITY_ACCEL - sign(dpy)*(dpy**2)*VERT_FRIC
+			if (len(heights) == 0):
+				forcey -= JUMP_ACCEL
+
+			if (dpx < VEL_CLAMTOZERO_RANGE and dpx > -VEL_CLAMTOZERO_RANGE):
+				dpx = 0.0
+			dpx += forcex * TILE_WIDTH * PHYSICS_TIME_STEP
+			dpy += forcey * TILE_WIDTH * PHYSICS_TIME_STEP
+			x += dpx * PHYSICS_TIME_STEP
+			y += dpy * PHYSICS_TIME_STEP
+			heights.append((-y/TILE_WIDTH, x/TILE_WIDTH))
+
+		maxrise = int(max(h for h, across in heights))
+		result = {}
+		for rise in range(-NAV_MAX_DROP, maxrise+1):
+			# x only grows, so the last point at least this high is the furthest
+			across = 0.0
+			for h, hx in heights:
+				if (h >= rise):
+					across = hx
+			result[rise] = int(across)
+		return result
+
+	def get_fits(self, x, y):
+		result = not self.geometry.any_geointiles(
+			x, y-self.bodyheight+1, x+self.bodywidth-1, y)
+		return result
+
+	def get_supported(self, x, y):
+		result = self.geometry.any_geointiles(x, y+1, x+self.bodywidth-1, y+1)
+		return result
+
+	def build(self):
+		geometry = self.geometry
+		self.geoversion = geometry.geoversion
+
+		self.nodes = set()
+		for y in range(geometry.height-1):
+			for x in range(geometry.width-self.bodywidth+1):
+				if (self.get_supported(x, y) and self.get_fits(x, y)):
+					self.nodes.add((x, y))
+
+		self.edges = {} # node -> [(node, cost, NavEdge), ...]
+		for node in sorted(self.nodes):
+			self.edges[node] = self.build_edges(node)
+
+		# old paths may go through geometry that has changed, and queued
+		# searches have to start over
+		pending = self.pending
+		self.pending = deque()
+		self.requests = {}
+		self.paths = OrderedDict()
+		for request in pending:
+			request.reset()
+			if (not request.start in self.nodes or not request.goal in self.nodes):
+				request.status = PathRequest.FAILED
+				continue
+			self.pending.append(request)
+			self.requests[(request.start, request.goal)] = request
+
+	def build_edges(self, node):
+		x, y = node
+		w = self.bodywidth
+		h = self.bodyheight
+		geometry = self.geometry
+		result = []
+
+		for side in (-1, 1):
+			nx = x + side
+			if ((nx, y) in self.nodes):
+				result.append(((nx, y), 1.0, NavEdge.WALK))
+			elif (self.get_fits(nx, y)):
+				# nothing to stand on next door, so fall until there is
+				row = geometry.get_firstgeorow(y+1, geometry.height-1, nx, nx+w-1)
+				if (row > y+1 and (nx, row-1) in self.nodes):
+					fall = row-1 - y
+					result.append(((nx, row-1), 1.0 + fall*NAV_DROP_COST, NavEdge.DROP))
+
+		for rise in self.jumpreach:
+			ny = y - rise
+			reach = self.jumpreach[rise]
+			for nx in range(x-reach, x+reach+1):
+				if (nx == x or (rise == 0 and abs(nx-x) == 1)):
+					continue
+				if (not (nx, ny) in self.nodes):
+					continue
+
+				minx = min(x, nx)
+				maxx = max(x, nx) + w - 1
+				if (rise >= 0):
+					# straight up over the takeoff, then across at landing height
+					clear = (
+						not geometry.any_geointiles(x, ny-h+1, x+w-1, y) and
+						not geometry.any_geointiles(minx, ny-h+1, maxx, ny))
+				else:
+					# across at takeoff height, then straight down onto the landing
+					clear = (
+						not geometry.any_geointiles(minx, y-h+1, maxx, y) and
+						not geometry.any_geointiles(nx, y-h+1, nx+w-1, ny))
+				if (clear):
+					cost = abs(nx-x) + abs(rise) + NAV_JUMP_COST
+					result.append(((nx, ny), cost, NavEdge.JUMP))
+
+		return result
+
+	# nearest node at or below a body's rect (in world coords), or None
+	def get_nodefromrect(self, rect):
+		x = int((rect.x + TILE_WIDTH/2) // TILE_WIDTH)
+		feet = int((rect.y + rect.height - TILE_WIDTH/2) // TILE_WIDTH)
+		for y in range(max(feet, 0), self.geometry.height):
+			if ((x, y) in self.nodes):
+				return (x, y)
+		return None
+
+	def get_heuristic(self, node, goal):
+		# cheapest any edge can be per tile on each axis, so never overestimates
+		result = abs(goal[0]-node[0]) + abs(goal[1]-node[1])*NAV_DROP_COST
+		return result
+
+	def request_path(self, start, goal):
+		if (self.geometry.geoversion != self.geoversion):
+			self.build()
+
+		key = (start, goal)
+		result = self.requests.get(key)
+		if (result is None):
+			result = self.paths.get(key)
+			if (not result is None):
+				self.paths.move_to_end(key)
+		if (result is None):
+			result = PathRequest(start, goal)
+			if (not start in self.nodes or not goal in self.nodes):
+				result.status = PathRequest.FAILED
+			else:
+				self.pending.append(result)
+				self.requests[key] = result
+		return result
+
+	# expand at most budget nodes across queued requests, returns how many it did
+	def update(self, budget=NAV_EXPANSIONS_PER_FRAME):
+		if (self.geometry.geoversion != self.geoversion):
+			self.build()
+
+		used = 0
+		while (used < budget and len(self.pending) > 0):
+			request = self.pending[0]
+			used += self.search(request, budget-used)
+			if (request.status != PathRequest.PENDING):
+				self.pending.popleft()
+				key = (request.start, request.goal)
+				del self.requests[key]
+				if (request.status == PathRequest.DONE):
+					self.paths[key] = request
+					# evict least recently asked for paths
+					while (len(self.paths) > NAV_PATHCACHE_SIZE):
+						self.paths.popitem(last=False)
+		return used
+
+	def search(self, request, budget):
+		openheap = request.openheap
+		gscore = request.gscore
+		camefrom = request.camefrom
+		goal = request.goal
+
+		expanded = 0
+		while (expanded < budget):
+			if (len(openheap) == 0):
+				request.status = PathRequest.FAILED
+				break
+
+			f, g, node = heappop(openheap)
+			if (g > gscore[node]):
+				# already found a shorter way here
+				continue
+			expanded += 1
+
+			if (node == goal):
+				request.finish()
+				break
+
+			for neighbor, cost, kind in self.edges[node]:
+				newg = g + cost
+				if (newg < gscore.get(neighbor, newg+1)):
+					gscore[neighbor] = newg
+					camefrom[neighbor] = (node, kind)
+					heappush(openheap, (newg + self.get_heuristic(neighbor, goal), newg, neighbor))
+
+		return expanded
+
+class PathRequest:
+	PENDING = 0
+	DONE = 1
+	FAILED = 2
+
+	def __init__(self, start, goal):
+		self.start = start
+		self.goal = goal
+		self.status = PathRequest.PENDING
+		self.path = None # [(node, NavEdge taken to get there), ...], start has None
+		self.reset()
+
+	def reset(self):
+		self.openheap = [(0, 0, self.start)]
+		self.gscore = {self.start : 0}
+		self.camefrom = {}
+		if (self.status != PathRequest.FAILED):
+			self.status = PathRequest.PENDING
+
+	def finish(self):
+		result = []
+		node = self.goal
+		while (node != self.start):
+			prev, kind = self.camefrom[node]
+			result.append((node, kind))
+			node = prev
+		result.append((self.start, None))
+		result.reverse()
+
+		self.path = result
+		self.status = PathRequest.DONE
+
+		# search state isn't needed anymore
+		self.openheap = None
+		self.gscore = None
+		self.camefrom = None
+
+'''
+AI scheduler. Agents think at AI_THINK_HZ instead of every physics step, and
+are spread over the physics steps in between: each agent gets a phase (the
+least loaded one when it's added), and each physics step only the agents with
+that step's phase become due.
+
+Due agents queue up and update() runs their think functions once per frame
+until the queue is empty or the frame's time budget is spent. Whatever is left
+stays queued for next frame, so lots of agents make AI late rather than make
+one frame slow. An agent still queued when it comes due again isn't queued
+twice.
+
+think(entity, dt) gets the game time since the agent last thought.
+'''
+class MegaBrain:
+	def __init__(self, thinkhz=AI_THINK_HZ):
+		self.period = max(1, int(round(1.0 / (thinkhz * PHYSICS_TIME_STEP))))
+		self.phases = [[] for i in range(self.period)]
+		self.agents = {} # entity -> BrainAgent
+		self.queue = deque()
+		self.stepnum = 0
+
+	def add_agent(self, entity, think):
+		phase = min(range(self.period), key=lambda pi: len(self.phases[pi]))
+		agent = BrainAgent(entity, think, phase, self.stepnum)
+		self.phases[phase].append(agent)
+		self.agents[entity] = agent
+
+	def remove_agent(self, entity):
+		agent = self.agents.pop(entity)
+		self.phases[agent.phase].remove(agent)
+		if (agent.queued):
+			self.queue.remove(agent)
+
+	# once per physics step
+	def step(self):
+		for agent in self.phases[self.stepnum % self.period]:
+			if (not agent.queued):
+				agent.queued = True
+				self.queue.append(agent)
+		self.stepnum += 1
+
+	# once per frame, returns how many agents thought
+	def update(self, budget=AI_FRAME_BUDGET_SEC):
+		start = time.perf_counter()
+		result = 0
+		while (len(self.queue) > 0):
+			agent = self.queue.popleft()
+			agent.queued = False
+
+			dt = (self.stepnum - agent.laststep) * PHYSICS_TIME_STEP
+			agent.laststep = self.stepnum
+			agent.think(agent.entity, dt)
+			result += 1
+
+			if (time.perf_counter() - start >= budget):
+				break
+		return result
+
+class BrainAgent:
+	__slots__ = ('entity', 'think', 'phase', 'laststep', 'queued')
+
+	def __init__(self, entity, think, phase, laststep):
+		self.entity = entity
+		self.think = think
+		self.phase = phase
+		self.laststep = laststep
+		self.queued = False
+
+'''
+Takes a body's moved rect and the solid tiles it overlaps, works out which
+sides it hit, and returns where the rect should actually end up.
+Sets the body's collision flags and zeroes velocity into the collision.
+tiles is the first numtiles of a list, as get_georectsfromrect fills it in.
+The probe rects are the body's own, and the result is one of them or rect.
+'''
+def resolve_geocollision(pb, rect, tiles, numtiles, geometry, dt=PHYSICS_TIME_STEP):
+	global highlight
+
+	result = rect
+
+	pbdp = pb.dp
+	x, y = pb.get_pos()
+	nearesttilepos = geometry.get_nearesttilepos(x, y)
+
+	if (DEBUG_HIGHLIGHT):
+		highlight.append((Rect(nearesttilepos, (TILE_WIDTH, TILE_WIDTH)), 'green'))
+
+	newrecth = pb.proberecth
+	newrecth.x = x + pbdp[0] * dt
+	newrecth.y = nearesttilepos[1] # this makes you fall into corners??
+
+	newrectv = pb.proberectv
+	newrectv.x = nearesttilepos[0] # this prevents getting caught on corners
+	newrectv.y = y + pbdp[1] * dt
+
+	horzcollide = False
+	vertcollide = False
+
+	ti = 0
+	while (ti < numtiles):
+		tile = tiles[ti]
+		ti += 1
+		if (pbdp[0] != 0 and newrecth.collides_rect(tile)):
+			horzcollide = True
+			if (pbdp[0] > 0):
+				pb.collide_right()
+				if (DEBUG_HIGHLIGHT):
+					highlight.append((tile.copy(), 'black'))
+			elif (pbdp[0] < 0):
+				pb.collide_left()
+				if (DEBUG_HIGHLIGHT):
+					highlight.append((tile.copy(), 'black'))
+
+		if (pbdp[1] != 0 and newrectv.collides_rect(tile)):
+			vertcollide = True
+			if (pbdp[1] > 0):
+				pb.collide_down()
+				if (DEBUG_HIGHLIGHT):
+					highlight.append((tile.copy(), 'red'))
+			elif (pbdp[1] < 0):
+				pb.collide_up()
+				if (DEBUG_HIGHLIGHT):
+					highlight.append((tile.copy(), 'red'))
+
+	# if you've collided, and you're moving diagonally, then
+	# you would be in a horz or vert collision,
+	# UNLESS you've collided perfectly diagonally on a corner.
+	diag_tile = None
+	diag_direction = (0, 0)
+	if (pbdp[0] != 0 and pbdp[1] != 0 and not (vertcollide or horzcollide)):
+		# check if moving into the block or away from it
+		ti = 0
+		while (ti < numtiles):
+			tile = tiles[ti]
+			ti += 1
+			diag_direction = (tile.x - x, tile.y - y)
+			if (sign(pbdp[0]) == sign(diag_direction[0])):
+				diag_tile = tile
+
+	# wall
+	if (not pb.get_collidesvert() and pb.get_collideshorz()):
+		newrectv.x = nearesttilepos[0]-sign(pbdp[0]) # nudge away from walls
+		result = newrectv
+		pb.dp = (0, pbdp[1])
+
+	# floor and ceiling
+	elif (pb.get_collidesvert() and not pb.get_collideshorz()):
+		newrecth.y = nearesttilepos[1]
+		result = newrecth
+		pb.dp = (pbdp[0], 0)
+
+	# concave corner
+	elif (pb.get_collidesvert() and pb.get_collideshorz()):
+		rect.x, rect.y = nearesttilepos
+		result = rect
+		pb.dp = (0, 0)
+
+	# convex corner, basically perfect diagonal velocity
+	elif (not diag_tile is None and 
+		not pb.get_collidesvert() and 
+		not pb.get_collideshorz()):
+		# corner is above
+		if (diag_direction[1] < 0):
+			# if falling, continue falling
+			if (pbdp[1] > 0):
+				rect.x, rect.y = nearesttilepos
+				result = rect
+				pb.dp = (0, pbdp[1])
+			# if rising, stop velocity
+			elif (pbdp[1] < 0):
+				newrecth.y = nearesttilepos[1]
+				result = newrecth
+				pb.dp = (0, 0)
+		# corner is below
+		elif (diag_direction[1] > 0):
+			# if falling, check for the fat catch, otherwise hit like a wall
+			if (pbdp[1] > 0):
+				fatrectv = newrectv.get_fat()
+				if (pbdp[1] != 0 and fatrectv.collides_rect(diag_tile)):
+					pb.collide_down()
+					if (DEBUG_HIGHLIGHT):
+						highlight.append((tile.copy(), 'red'))
+					result = newrecth
+					pb.dp = (pbdp[0], 0)
+				else:
+					newrectv.x = nearesttilepos[0]
+					result = newrectv
+					pb.dp = (0, pbdp[1])
+			# if rising, continue rising
+			elif (pbdp[1] < 0):
+				newrecth.y = nearesttilepos[1]
+				result = newrecth
+				pb.dp = (0, pbdp[1])
+
+	return result
+
+'''
+Continuous version of resolve_geocollision. Moves the body along x, then along
+y, and on each axis stops it at the first solid tile its leading edge would
+sweep through, instead of snapping to the nearest tile after the fact.
+Doesn't skip tiles however big dp*dt gets, so the physics step can be longer.
+'''
+def sweep_geocollision(pb, geometry, dt=PHYSICS_TIME_STEP):
+	x, y = pb.get_pos()
+	width, height = pb.get_dim()
+	dpx = pb.dpx
+	dpy = pb.dpy
+	eps = SWEEP_EPSILON
+
+	# only tiles past the leading edge are swept, so a body already touching
+	# or overlapping something is never pushed back the way it came
+
+	# horizontal, against the rows the body covers
+	dx = dpx * dt
+	if (dx != 0):
+		miny = int((y+eps)//TILE_WIDTH)
+		maxy = int(ceil((y+height-eps)/TILE_WIDTH)) - 1
+		col = -1
+		if (dx > 0):
+			fromx = int(ceil((x+width-eps)/TILE_WIDTH))
+			tox = int((x+width+dx-eps)//TILE_WIDTH)
+			if (tox >= fromx):
+				col = geometry.get_firstgeocol(fromx, tox, miny, maxy)
+			if (col >= 0):
+				dx = max(col*TILE_WIDTH - width - x, 0)
+				pb.collide_right()
+		else:
+			fromx = int((x+eps)//TILE_WIDTH) - 1
+			tox = int((x+dx+eps)//TILE_WIDTH)
+			if (tox <= fromx):
+				col = geometry.get_firstgeocol(fromx, tox, miny, maxy)
+			if (col >= 0):
+				dx = min((col+1)*TILE_WIDTH - x, 0)
+				pb.collide_left()
+		x += dx
+		if (pb.get_collideshorz()):
+			dpx = 0
+
+	# vertical, against the columns the body covers after moving horizontally
+	dy = dpy * dt
+	if (dy != 0):
+		minx = int((x+eps)//TILE_WIDTH)
+		maxx = int(ceil((x+width-eps)/TILE_WIDTH)) - 1
+		row = -1
+		if (dy > 0):
+			fromy = int(ceil((y+height-eps)/TILE_WIDTH))
+			toy = int((y+height+dy-eps)//TILE_WIDTH)
+			if (toy >= fromy):
+				row = geometry.get_firstgeorow(fromy, toy, minx, maxx)
+			if (row >= 0):
+				dy = max(row*TILE_WIDTH - height - y, 0)
+				pb.collide_down()
+		else:
+			fromy = int((y+eps)//TILE_WIDTH) - 1
+			toy = int((y+dy+eps)//TILE_WIDTH)
+			if (toy <= fromy):
+				row = geometry.get_firstgeorow(fromy, toy, minx, maxx)
+			if (row >= 0):
+				dy = min((row+1)*TILE_WIDTH - y, 0)
+				pb.collide_up()
+		y += dy
+		if (pb.get_collidesvert()):
+			dpy = 0
+
+	pb.dpx = dpx
+	pb.dpy = dpy
+
+	result = pb.steprect
+	result.x = x
+	result.y = y
+	return result
+
+def update_physicsbodies(entities, numentities, geometry, spatialhash=None,
+	dt=PHYSICS_TIME_STEP, swept=SWEPT_COLLISION):
+	# get every new rect by moving it and reconciling it with collisions.
+	# everything lives in storage the bodies already own (velocity and force
+	# scalars, collisions, steprect), and each body is resolved before the
+	# next one moves, so a step doesn't allocate (nor does contact
+	# resolution, see get_georectsfromrect). bodies only collide with
+	# geometry, so going one body at a time changes nothing.
+	bi = 0
+	while (bi < numentities):
+		e = entities[bi]
+		bi += 1
 
 		pb = e.physics
 		if (pb is None):
-			new_rects.append(None)
 			continue
 
-		newrect = pb.rect().copy()
+		if (pb.sleeping):
+			if (pb.get_staysasleep(geometry.geoversion)):
+				# nothing has changed since it settled. keeps its collisions.
+				pb.clearforces()
+				pb.stepped = False
+				continue
+			pb.wake()
+		pb.stepped = True
+
+		# remember how this step's forces compare to the last, for sleeping
+		pb.sameforce = (pb.forcex == pb.restforcex and pb.forcey == pb.restforcey)
+		pb.restforcex = pb.forcex
+		pb.restforcey = pb.forcey
 
-		# add all forces
-		sum_forces = sum_tuples(pb.forces)
 		# divide out mass
-		ddp = tuple_mult(sum_forces, 1/pb.mass)
+		invmass = 1/pb.mass
+		ddpx = pb.forcex * invmass
+		ddpy = pb.forcey * invmass
 
 		# if horizontal velocity is sufficiently close to zero, just make it zero
-		if (pb.dp[0] < VEL_CLAMTOZERO_RANGE and pb.dp[0] > -VEL_CLAMTOZERO_RANGE):
-			pb.dp = (0.0, pb.dp[1])	
+		dpx = pb.dpx
+		dpy = pb.dpy
+		if (dpx < VEL_CLAMTOZERO_RANGE and dpx > -VEL_CLAMTOZERO_RANGE):
+			dpx = 0.0
 
 		# update velocity with integration of accel
-		pb.dp = v2_add(pb.dp, tuple_mult(ddp, PHYSICS_TIME_STEP))
+		dpx += ddpx * dt
+		dpy += ddpy * dt
+		pb.dpx = dpx
+		pb.dpy = dpy
 
 		'''
 		# move() using kinematics and old velocity
@@ -531,11 +1882,9 @@ def update_physicsbodies(entities, numentities, geometry):
 		'''
 
 		# move() using kinematics and old velocity
-		deltapos = tuple_mult(pb.dp, PHYSICS_TIME_STEP)
-		newrect.move(deltapos)
-
-		# put it in the list
-		new_rects.append(newrect)
+		rect = pb.steprect
+		rect.x = e.x + dpx * dt
+		rect.y = e.y + dpy * dt
 
 		# clear forces
 		pb.clearforces()
@@ -543,130 +1892,274 @@ def update_physicsbodies(entities, numentities, geometry):
 		# clear collisions
 		pb.clearcollisions()
 
-	# if rect collides with geometry, clamp to nearest tile boundary
-	for ri in range(numentities):
-		rect = new_rects[ri]
-		if (rect is None):
+		# if rect collides with geometry, clamp to nearest tile boundary
+		if (swept):
+			# checks the whole path, not just where the rect ended up
+			sweep_geocollision(pb, geometry, dt)
+		else:
+			numtiles = geometry.get_georectsfromrect(rect)
+
+			if (numtiles > 0):
+				# if there are any tiles in get_georectsfromrect(rect), 
+				# then there is a collision with geometry
+				resolved = resolve_geocollision(
+					pb, rect, geometry.georectscratch, numtiles, geometry, dt)
+				rect.x = resolved.x
+				rect.y = resolved.y
+
+		# if rect collides with other physics bodies and is "solid", 
+		# don't move (apply backwards force??)
+		# candidates for this come from spatialhash.find_pairs()
+
+		# attacks are checked after movement, see CombatStage
+
+		# resolve rect, put the body to sleep if it has come to rest,
+		# and keep the broadphase in step with it
+		e.x = rect.x
+		e.y = rect.y
+
+		pb.update_sleep(geometry.geoversion)
+		if (not spatialhash is None):
+			spatialhash.update(e, rect)
+
+	# wake anything moving bodies touch, once everything has moved
+	if (not spatialhash is None):
+		for e in entities:
+			pb = e.physics
+			if (not pb is None and pb.stepped and (pb.dpx != 0 or pb.dpy != 0)):
+				wake_contacts(spatialhash, e, pb.steprect)
+
+def wake_contacts(spatialhash, entity, rect):
+	for other in spatialhash.query_rect(rect.get_fat(), exclude=entity):
+		if (not other.physics is None and other.physics.sleeping):
+			other.physics.wake()
+
+class SimLOD(IntEnum):
+	FULL = 0
+	COARSE = 1
+	FROZEN = 2
+
+# tier by how many tiles the body is outside what the camera can see
+def get_simlod(entity, bounds):
+	pb = entity.physics
+	width, height = pb.get_dim()
+	minx = entity.x / TILE_WIDTH
+	miny = entity.y / TILE_WIDTH
+	maxx = (entity.x + width) / TILE_WIDTH
+	maxy = (entity.y + height) / TILE_WIDTH
+
+	distx = max(bounds.x - maxx, minx - (bounds.x + bounds.width), 0)
+	disty = max(bounds.y - maxy, miny - (bounds.y + bounds.height), 0)
+	dist = max(distx, disty)
+
+	result = SimLOD.FROZEN
+	if (dist <= LOD_FULL_TILES):
+		result = SimLOD.FULL
+	elif (dist <= LOD_COARSE_TILES):
+		result = SimLOD.COARSE
+	return result
+
+'''
+update_physicsbodies with simulation LOD by distance from the camera's
+get_maptilebounds:
+	FULL: on screen (or nearly), stepped every step as usual
+	COARSE: nearby, stepped every LOD_COARSE_STEPS steps with a time step
+		that covers all the steps since the last one, swept so the longer
+		step can't tunnel through anything
+	FROZEN: far away, not stepped and time doesn't pass for it
+
+pb.simstep is the last step a body has been simulated up to. A body that
+comes back into full range from COARSE is first caught up with one step
+covering the steps it missed, so it rejoins in sync. Coming out of FROZEN
+there's nothing to catch up. Forces added while a coarse body waits for its
+step add up (pb.forcesteps counts the steps), and the step applies their
+average over its longer time step, so a force that only lasts one step (a
+jump, a push) still gives the same impulse. Forces on a FROZEN body
+are dropped, since no time passes for it.
+
+Coarse bodies start out spread over the LOD_COARSE_STEPS steps by id.
+'''
+def update_physicsbodies_lod(entities, geometry, camera, stepnum, spatialhash=None,
+	dt=PHYSICS_TIME_STEP):
+	bounds = camera.get_maptilebounds(geometry)
+
+	full = []
+	catchup = {} # steps covered -> bodies
+	for e in entities:
+		pb = e.physics
+		if (pb is None):
 			continue
 
-		tiles = geometry.get_tilesfromrect(rect)
-
-		if (len(tiles) > 0):
-			# if there are any tiles in get_tilesfromrect(rect), 
-			# then there is a collision with geometry
-
-			global highlight
-
-			pb = entities[ri].physics
-			pbdp = pb.dp
-			nearesttilepos = geometry.get_nearesttilepos(*pb.get_pos())
-
-			highlight.append((Rect(nearesttilepos, (TILE_WIDTH, TILE_WIDTH)), 'green'))
-
-			newrecth = pb.rect().copy()
-			newrecth.x += pbdp[0] * PHYSICS_TIME_STEP
-			newrecth.y = nearesttilepos[1] # this makes you fall into corners??
-
-			newrectv = pb.rect().copy()
-			newrectv.x = nearesttilepos[0] # this prevents getting caught on corners
-			newrectv.y += pbdp[1] * PHYSICS_TIME_STEP
-
-			horzcollide = False
-			vertcollide = False
-
-			for tile in tiles:
-				if (pbdp[0] != 0 and newrecth.collides_rect(tile)):
-					horzcollide = True
-					if (pbdp[0] > 0):
-						pb.collide_right()
-						highlight.append((tile, 'black'))
-					elif (pbdp[0] < 0):
-						pb.collide_left()
-						highlight.append((tile, 'black'))
-
-				if (pbdp[1] != 0 and newrectv.collides_rect(tile)):
-					vertcollide = True
-					if (pbdp[1] > 0):
-						pb.collide_down()
-						highlight.append((tile, 'red'))
-					elif (pbdp[1] < 0):
-						pb.collide_up()
-						highlight.append((tile, 'red'))
-
-			# if you've collided, and you're moving diagonally, then
-			# you would be in a horz or vert collision,
-			# UNLESS you've collided perfectly diagonally on a corner.
-			diag_tile = None
-			diag_direction = (0, 0)
-			if (pbdp[0] != 0 and pbdp[1] != 0 and not (vertcollide or horzcollide)):
-				# check if moving into the block or away from it
-				for tile in tiles:
-					diag_direction = (tile.x - pb.rect().x, tile.y - pb.rect().y)
-					if (sign(pbdp[0]) == sign(diag_direction[0])):
-						diag_tile = tile
-
-			# wall
-			if (not pb.get_collidesvert() and pb.get_collideshorz()):
-				newrectv.x = nearesttilepos[0]-sign(pbdp[0]) # nudge away from walls
-				new_rects[ri] = newrectv
-				entities[ri].physics.dp = (0, pbdp[1])
-
-			# floor and ceiling
-			elif (pb.get_collidesvert() and not pb.get_collideshorz()):
-				newrecth.y = nearesttilepos[1]
-				new_rects[ri] = newrecth
-				entities[ri].physics.dp = (pbdp[0], 0)
-
-			# concave corner
-			elif (pb.get_collidesvert() and pb.get_collideshorz()):
-				new_rects[ri] = Rect(nearesttilepos, pb.get_dim())
-				entities[ri].physics.dp = (0, 0)
-
-			# convex corner, basically perfect diagonal velocity
-			elif (not diag_tile is None and 
-				not pb.get_collidesvert() and 
-				not pb.get_collideshorz()):
-				# corner is above
-				if (diag_direction[1] < 0):
-					# if falling, continue falling
-					if (pbdp[1] > 0):
-						new_rects[ri] = Rect(nearesttilepos, pb.get_dim())
-						entities[ri].physics.dp = (0, pbdp[1])
-					# if rising, stop velocity
-					elif (pbdp[1] < 0):
-						newrecth.y = nearesttilepos[1]
-						new_rects[ri] = newrecth
-						entities[ri].physics.dp = (0, 0)
-				# corner is below
-				elif (diag_direction[1] > 0):
-					# if falling, check for the fat catch, otherwise hit like a wall
-					if (pbdp[1] > 0):
-						fatrectv = newrectv.get_fat()
-						if (pbdp[1] != 0 and fatrectv.collides_rect(diag_tile)):
-							pb.collide_down()
-							highlight.append((tile, 'red'))
-							new_rects[ri] = newrecth
-							entities[ri].physics.dp = (pbdp[0], 0)
-						else:
-							newrectv.x = nearesttilepos[0]
-							new_rects[ri] = newrectv
-							entities[ri].physics.dp = (0, pbdp[1])
-					# if rising, continue rising
-					elif (pbdp[1] < 0):
-						newrecth.y = nearesttilepos[1]
-						new_rects[ri] = newrecth
-						entities[ri].physics.dp = (0, pbdp[1])
-
-
-	# if rect collides with other physics bodies and is "solid", 
-	# don't move (apply backwards force??)
-
-	# if rect is collides with an attack, don't move
-
-	# resolve rects
-	for pbi in range(numentities):
-		entities[pbi].x = new_rects[pbi].x
-		entities[pbi].y = new_rects[pbi].y
+		lod = get_simlod(e, bounds)
+		if (pb.simlod == SimLOD.FROZEN or pb.simstep is None):
+			# nothing to catch up on
+			pb.simstep = stepnum - 1
+			if (lod == SimLOD.COARSE and not e.id is None):
+				pb.simstep -= e.id % LOD_COARSE_STEPS
+		pb.simlod = lod
+
+		elapsed = stepnum - pb.simstep
+		if (lod == SimLOD.FULL and elapsed == 1):
+			full.append(e)
+		elif (lod == SimLOD.FULL or
+			(lod == SimLOD.COARSE and elapsed >= LOD_COARSE_STEPS)):
+			group = catchup.get(elapsed)
+			if (group is None):
+				group = []
+				catchup[elapsed] = group
+			group.append(e)
+		elif (lod == SimLOD.FROZEN):
+			pb.clearforces()
+			continue
+		else:
+			# waiting for its coarse step, this step's forces add up for it
+			pb.forcesteps += 1
+			continue
+
+		pb.simstep = stepnum
+
+	update_physicsbodies(full, len(full), geometry, spatialhash, dt=dt)
+	for elapsed in sorted(catchup):
+		group = catchup[elapsed]
+		for e in group:
+			# average, so the longer step gives the same impulse they added up to
+			pb = e.physics
+			steps = pb.forcesteps + 1
+			pb.forcex /= steps
+			pb.forcey /= steps
+		update_physicsbodies(
+			group, len(group), geometry, spatialhash,
+			dt=elapsed*dt, swept=True)
+
+class AttackKind(IntEnum):
+	LIGHT = 0
+	HEAVY = 1
+
+# seconds out, reach in tiles, knockback
+attack_stats = {
+	AttackKind.LIGHT : (LIGHT_ATTACK_SEC, LIGHT_ATTACK_REACH, LIGHT_ATTACK_KNOCKBACK),
+	AttackKind.HEAVY : (HEAVY_ATTACK_SEC, HEAVY_ATTACK_REACH, HEAVY_ATTACK_KNOCKBACK),
+}
+
+# out for as long as its owner's swing is, see player_handleinput
+class Hitbox:
+	__slots__ = ('owner', 'kind', 'reach', 'knockback', 'facing', 'rect', 'hits')
+
+	def __init__(self, owner, kind):
+		self.owner = owner
+		self.kind = kind
+		swingtime, self.reach, self.knockback = attack_stats[kind]
+		self.facing = owner.facing_direction
+		self.rect = Rect((0, 0), (self.reach*TILE_WIDTH, 0))
+		self.hits = set() # ids of everything this swing has hit already
+
+	# out in front of the owner's body and as tall as it
+	def place(self, ownerrect, facingdir):
+		rect = self.rect
+		rect.width = self.reach*TILE_WIDTH
+		rect.height = ownerrect.height
+		rect.y = ownerrect.y
+		if (facingdir > 0):
+			rect.x = ownerrect.x + ownerrect.width
+		else:
+			rect.x = ownerrect.x - rect.width
+		self.facing = facingdir
+
+	# a new button press starts a new attack, which ends this one's swing
+	def get_active(self):
+		player = self.owner.player
+		result = (
+			not self.owner.id is None and not player is None and
+			player.atkexecuted and player.attack_timer > 0.0)
+		return result
+
+'''
+Combat collision, run once per physics step after movement. Every active
+attack has a Hitbox that follows its owner and is out for as long as the
+owner's attack_timer runs the swing down. Hurtboxes are the body rects
+already in the broadphase, so each hitbox is one query_rect on the spatial
+hash and nothing gets tested against every entity.
+
+A hitbox remembers the ids it has hit, so a swing hits each target once
+however many steps they overlap. update() returns all of the step's hits at
+once as (hitbox, target) pairs, in hitbox order and then by target id so it
+comes out the same every run. The list is reused, use it before the next
+update().
+'''
+class CombatStage:
+	def __init__(self):
+		self.hitboxes = []
+		self.events = []
+
+	def add_attack(self, owner, kind):
+		result = Hitbox(owner, kind)
+		self.hitboxes.append(result)
+		return result
+
+	def update(self, spatialhash):
+		events = self.events
+		events.clear()
+
+		expired = False
+		for hitbox in self.hitboxes:
+			owner = hitbox.owner
+			if (not hitbox.get_active() or not spatialhash.has(owner)):
+				expired = True
+				continue
+
+			hitbox.place(spatialhash.get_rect(owner), owner.facing_direction)
+
+			hits = hitbox.hits
+			targets = []
+			for target in spatialhash.query_rect(hitbox.rect, exclude=owner):
+				if (not target.id is None and not target.id in hits):
+					hits.add(target.id)
+					targets.append(target)
+			if (len(targets) > 1):
+				targets.sort(key=lambda e: e.id)
+			for target in targets:
+				events.append((hitbox, target))
+
+		if (expired):
+			self.hitboxes = [
+				hitbox for hitbox in self.hitboxes
+				if (hitbox.get_active() and spatialhash.has(hitbox.owner))]
+
+		result = events
+		return result
+
+	def serialize(self):
+		hitboxes = []
+		for hitbox in self.hitboxes:
+			if (not hitbox.get_active()):
+				# goes next update without hitting anything
+				continue
+			hitboxes.append({
+				"owner" : hitbox.owner.id,
+				"kind" : int(hitbox.kind),
+				"facing" : hitbox.facing,
+				"hits" : sorted(hitbox.hits),
+			})
+		result = {"hitboxes" : hitboxes}
+		return result
+
+	def load(self, data, worldstate):
+		self.hitboxes = []
+		for hdata in data["hitboxes"]:
+			owner = worldstate.get_entity(hdata["owner"])
+			assert(not owner is None)
+			hitbox = Hitbox(owner, AttackKind(hdata["kind"]))
+			hitbox.facing = hdata["facing"]
+			hitbox.hits = set(hdata["hits"])
+			self.hitboxes.append(hitbox)
+
+# knock everything that got hit away from whoever hit it
+def apply_hits(events):
+	for hitbox, target in events:
+		if (target.physics is None):
+			continue
+		impulse = (hitbox.facing*hitbox.knockback, 0)
+		target.physics.addimpulse(impulse)
 
 """
 NOTE: implementation of collision assumes all physics bodies have
@@ -678,19 +2171,60 @@ TODO: replace/condense get and set functions for collisions by using Enums
 as named indexes in the collisions array.
 '''
 class PhysicsBody:
+	__slots__ = (
+		'entity', 'widthintiles', 'heightintiles', 'dim', 'mass', 'dpx', 'dpy',
+		'forcex', 'forcey', 'forcesteps', 'collisions', 'steprect', 'proberecth',
+		'proberectv', 'stepped',
+		'sleeping', 'sleeptimer', 'restforcex', 'restforcey', 'sameforce',
+		'sleepgeoversion', 'simlod', 'simstep')
+
 	def __init__(self, widthintiles=1, heightintiles=1, mass=1.0):
 		self.entity = None
 		self.widthintiles = widthintiles
 		self.heightintiles = heightintiles
 		self.dim = (float(widthintiles*TILE_WIDTH), float(heightintiles*TILE_WIDTH))
 		self.mass = mass
-		self.dp = (0, 0)
-		self.forces = []
+		# velocity, as scalars so the step doesn't make a tuple per body
+		self.dpx = 0.0
+		self.dpy = 0.0
+		# accumulated since the last step, already scaled by TILE_WIDTH
+		self.forcex = 0.0
+		self.forcey = 0.0
+		self.forcesteps = 0 # extra steps they've added up over, see update_physicsbodies_lod
 
 		# bounding boxes completely within self.rect??
 
 		self.collisions = [0]*4
 
+		# where the body is moving to this step, and where resolve_geocollision
+		# probes each axis from, reused every step
+		self.steprect = Rect((0, 0), self.dim)
+		self.proberecth = Rect((0, 0), self.dim)
+		self.proberectv = Rect((0, 0), self.dim)
+		self.stepped = False
+
+		# a body resting on the ground under the same forces for SLEEP_STEPS
+		# steps sleeps: it's skipped by the physics step until something changes
+		self.sleeping = False
+		self.sleeptimer = 0
+		self.restforcex = 0.0
+		self.restforcey = 0.0
+		self.sameforce = False
+		self.sleepgeoversion = 0
+
+		# see update_physicsbodies_lod
+		self.simlod = SimLOD.FULL
+		self.simstep = None # not simulated yet
+
+	@property
+	def dp(self):
+		result = (self.dpx, self.dpy)
+		return result
+
+	@dp.setter
+	def dp(self, dp):
+		self.dpx, self.dpy = dp
+
 	def rect(self):
 		result = Rect((self.entity.x, self.entity.y), self.dim)
 		return result
@@ -702,19 +2236,34 @@ class PhysicsBody:
 	def set_pos(self, pos):
 		self.entity.x = pos[0]
 		self.entity.y = pos[1]
+		self.wake()
 
 	def get_dim(self):
 		result = self.dim
 		return result
 
 	def clearforces(self):
-		self.forces = []
+		self.forcex = 0.0
+		self.forcey = 0.0
+		self.forcesteps = 0
 
 	def addforce(self, force):
-		self.forces.append(tuple_mult(force, TILE_WIDTH))
+		self.forcex += force[0] * TILE_WIDTH
+		self.forcey += force[1] * TILE_WIDTH
+
+	# straight onto the velocity, for knocks that have to land in one step
+	def addimpulse(self, impulse):
+		invmass = 1/self.mass
+		self.dpx += impulse[0] * TILE_WIDTH * invmass
+		self.dpy += impulse[1] * TILE_WIDTH * invmass
+		self.wake()
 
 	def clearcollisions(self):
-		self.collisions = [0]*4
+		collisions = self.collisions
+		collisions[0] = 0
+		collisions[1] = 0
+		collisions[2] = 0
+		collisions[3] = 0
 
 	def collide_up(self):
 		self.collisions[0] += 1
@@ -749,22 +2298,584 @@ class PhysicsBody:
 		return result
 
 	def halt_vert_vel(self):
-		self.dp = (self.dp[0], 0.0)
+		self.dpy = 0.0
 
-class EntityLoader:
-	def __init__(self, spritebatch):
-		fin = open('./data/entitydata.json')
-		self.entitydata = json.load(fin)
-		fin.close()
+	def wake(self):
+		self.sleeping = False
+		self.sleeptimer = 0
 
-		self.spritebatch = spritebatch
+	# stays asleep while it gets the forces it settled under and the map is the same
+	def get_staysasleep(self, geoversion):
+		result = (
+			self.forcex == self.restforcex and self.forcey == self.restforcey and
+			geoversion == self.sleepgeoversion)
+		return result
 
-	def create_entity(self, ename, position=(0,0)):
-		assert(ename in self.entitydata)
+	# called after every step the body was awake for
+	def update_sleep(self, geoversion):
+		dpx = self.dpx
+		dpy = self.dpy
+		still = (
+			self.get_collidedown() and
+			dpx < SLEEP_VEL_RANGE and dpx > -SLEEP_VEL_RANGE and
+			dpy < SLEEP_VEL_RANGE and dpy > -SLEEP_VEL_RANGE and
+			self.sameforce)
+
+		if (still):
+			self.sleeptimer += 1
+		else:
+			self.sleeptimer = 0
 
-		position = position
+		if (self.sleeptimer >= SLEEP_STEPS):
+			self.sleeping = True
+			self.sleepgeoversion = geoversion
+			self.dpx = 0.0
+			self.dpy = 0.0
 
-		edata = self.entitydata[ename]
+	# everything the next step needs apart from position, for keyframes
+	def serialize(self):
+		result = {
+			"dp" : [self.dpx, self.dpy],
+			"force" : [self.forcex, self.forcey],
+			"forcesteps" : self.forcesteps,
+			"collisions" : list(self.collisions),
+			"sleeping" : self.sleeping,
+			"sleeptimer" : self.sleeptimer,
+			"restforce" : [self.restforcex, self.restforcey],
+			"sameforce" : self.sameforce,
+			"sleepgeoversion" : self.sleepgeoversion,
+			"simlod" : int(self.simlod),
+			"simstep" : self.simstep,
+		}
+		return result
+
+	def load(self, data):
+		self.dpx, self.dpy = data["dp"]
+		self.forcex, self.forcey = data["force"]
+		self.forcesteps = data["forcesteps"]
+		self.collisions[:] = data["collisions"]
+		self.sleeping = data["sleeping"]
+		self.sleeptimer = data["sleeptimer"]
+		self.restforcex, self.restforcey = data["restforce"]
+		self.sameforce = data["sameforce"]
+		self.sleepgeoversion = data["sleepgeoversion"]
+		self.simlod = SimLOD(data["simlod"])
+		self.simstep = data["simstep"]
+
+# collision grid as a (height, width) numpy bool array
+def get_geogrid(geometry):
+	result = np.zeros((geometry.height, geometry.width), dtype=bool)
+	numbytes = (geometry.width + 7) // 8
+	for j in range(geometry.height):
+		rowbytes = np.frombuffer(geometry.georows[j].to_bytes(numbytes, 'little'), dtype=np.uint8)
+		result[j] = np.unpackbits(rowbytes, bitorder='little')[:geometry.width]
+	return result
+
+'''
+Struct-of-arrays version of update_physicsbodies: positions, velocities,
+accumulated forces, masses and collision counters for every body live in
+numpy arrays, and integration runs over all bodies at once.
+
+A summed-area table of the collision grid tells (for all bodies at once)
+which moved rects overlap any geometry. Only those go through the same
+resolve_geocollision as the scalar path, so results match it exactly.
+
+Bodies are ArrayPhysicsBody, which has the PhysicsBody interface but reads
+and writes the arrays, so player code doesn't care which engine it's on.
+Entity x/y are only written back in sync_entities().
+'''
+class PhysicsArrays:
+	def __init__(self, capacity=64):
+		assert(not np is None)
+
+		self.count = 0
+		self.capacity = 0
+		self.bodies = []
+
+		self.pos = np.zeros((0, 2))
+		self.dp = np.zeros((0, 2))
+		self.force = np.zeros((0, 2))
+		self.invmass = np.zeros(0)
+		self.dim = np.zeros((0, 2))
+		self.collisions = np.zeros((0, 4), dtype=np.int64)
+		self.asleep = np.zeros(0, dtype=bool)
+		self.sleeptimer = np.zeros(0, dtype=np.int64)
+		self.restforce = np.zeros((0, 2))
+		self.reserve(capacity)
+
+		self.geometry = None
+		self.geosat = None
+		self.geoversion = 0
+
+	def reserve(self, capacity):
+		if (capacity <= self.capacity):
+			return
+
+		self.pos = self.grow_array(self.pos, capacity)
+		self.dp = self.grow_array(self.dp, capacity)
+		self.force = self.grow_array(self.force, capacity)
+		self.invmass = self.grow_array(self.invmass, capacity)
+		self.dim = self.grow_array(self.dim, capacity)
+		self.collisions = self.grow_array(self.collisions, capacity)
+		self.asleep = self.grow_array(self.asleep, capacity)
+		self.sleeptimer = self.grow_array(self.sleeptimer, capacity)
+		self.restforce = self.grow_array(self.restforce, capacity)
+		self.capacity = capacity
+
+	def grow_array(self, array, capacity):
+		result = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+		result[:self.count] = array[:self.count]
+		return result
+
+	def add_entity(self, entity):
+		oldpb = entity.physics
+		if (self.count == self.capacity):
+			self.reserve(self.capacity*2)
+
+		slot = self.count
+		self.count += 1
+
+		pb = ArrayPhysicsBody(self, slot, oldpb.widthintiles, oldpb.heightintiles)
+		self.pos[slot] = (entity.x, entity.y)
+		self.dp[slot] = oldpb.dp
+		self.invmass[slot] = 1/oldpb.mass
+		self.dim[slot] = oldpb.dim
+		pb.mass = oldpb.mass
+
+		pb.entity = entity
+		entity.physics = pb
+		self.bodies.append(pb)
+
+		return pb
+
+	def remove_entity(self, entity):
+		# move the last body into the freed slot to keep the arrays packed
+		pb = entity.physics
+		slot = pb.slot
+		last = self.count - 1
+		if (slot != last):
+			for array in (
+				self.pos, self.dp, self.force, self.invmass, self.dim,
+				self.collisions, self.asleep, self.sleeptimer, self.restforce):
+				array[slot] = array[last]
+			moved = self.bodies[last]
+			moved.slot = slot
+			self.bodies[slot] = moved
+
+		self.bodies.pop()
+		self.count -= 1
+
+	def sync_entities(self):
+		for pb in self.bodies:
+			pb.entity.x, pb.entity.y = pb.get_pos()
+
+	def build_geosat(self, geometry):
+		# summed-area table, padded with a zero row/column at the top left
+		geo = get_geogrid(geometry).astype(np.int32)
+
+		self.geosat = np.zeros((geometry.height+1, geometry.width+1), dtype=np.int32)
+		self.geosat[1:, 1:] = geo.cumsum(axis=0).cumsum(axis=1)
+		self.geometry = geometry
+		self.geoversion = geometry.geoversion
+
+	def update(self, geometry, spatialhash=None, dt=PHYSICS_TIME_STEP, swept=SWEPT_COLLISION):
+		n = self.count
+		asleep = self.asleep[:n]
+
+		if (not geometry is self.geometry or geometry.geoversion != self.geoversion):
+			# map changed, so anything resting on it has to look again
+			self.build_geosat(geometry)
+			asleep[:] = False
+
+		pos = self.pos[:n]
+		dp = self.dp[:n]
+		force = self.force[:n]
+		restforce = self.restforce[:n]
+
+		# sleepers stay asleep while they get the forces they settled under
+		sameforce = (force == restforce).all(axis=1)
+		asleep &= sameforce
+		awake = ~asleep
+
+		# divide out mass
+		ddp = force * self.invmass[:n, None]
+
+		# if horizontal velocity is sufficiently close to zero, just make it zero
+		dpx = dp[:, 0]
+		dpx[(dpx < VEL_CLAMTOZERO_RANGE) & (dpx > -VEL_CLAMTOZERO_RANGE)] = 0.0
+
+		# update velocity with integration of accel
+		dp[awake] += ddp[awake] * dt
+
+		# move using old velocity
+		newpos = pos + dp * dt
+
+		restforce[:] = force
+		force[:] = 0.0
+		self.collisions[:n][awake] = 0
+
+		# tile bounds of every moved rect, same as get_tilesfromrect
+		boxmin, boxmax = newpos, newpos + self.dim[:n]
+		if (swept):
+			# the whole path the rect sweeps through this step
+			boxmin = np.minimum(pos, newpos)
+			boxmax = np.maximum(pos, newpos) + self.dim[:n]
+		mintile = (boxmin // TILE_WIDTH).astype(np.int64)
+		maxtile = (boxmax // TILE_WIDTH).astype(np.int64)
+		minx, miny = mintile[:, 0], mintile[:, 1]
+		maxx, maxy = maxtile[:, 0], maxtile[:, 1]
+
+		# anything off the map takes the scalar path so edge behavior matches
+		offmap = (
+			(minx < 0) | (miny < 0) |
+			(maxx >= geometry.width) | (maxy >= geometry.height))
+		minx = np.clip(minx, 0, geometry.width-1)
+		miny = np.clip(miny, 0, geometry.height-1)
+		maxx = np.clip(maxx, 0, geometry.width-1)
+		maxy = np.clip(maxy, 0, geometry.height-1)
+
+		sat = self.geosat
+		solidcount = (
+			sat[maxy+1, maxx+1] - sat[miny, maxx+1] -
+			sat[maxy+1, minx] + sat[miny, minx])
+
+		# if rect collides with geometry, clamp to nearest tile boundary
+		for bi in np.flatnonzero(((solidcount > 0) | offmap) & awake):
+			pb = self.bodies[bi]
+			if (swept):
+				rect = sweep_geocollision(pb, geometry, dt)
+				newpos[bi] = (rect.x, rect.y)
+				continue
+			rect = Rect(newpos[bi].tolist(), pb.dim)
+			numtiles = geometry.get_georectsfromrect(rect)
+			if (numtiles > 0):
+				rect = resolve_geocollision(
+					pb, rect, geometry.georectscratch, numtiles, geometry, dt)
+				newpos[bi] = (rect.x, rect.y)
+
+		# resolve rects
+		pos[:] = newpos
+
+		# keep the broadphase in step with the bodies
+		if (not spatialhash is None):
+			bodies = self.bodies
+			for bi in range(n):
+				pb = bodies[bi]
+				if (awake[bi] and spatialhash.has(pb.entity)):
+					spatialhash.update(pb.entity, pb.rect())
+
+		# put bodies that have come to rest to sleep
+		still = (
+			awake & sameforce & (self.collisions[:n, 1] > 0) &
+			(np.abs(dp) < SLEEP_VEL_RANGE).all(axis=1))
+		sleeptimer = self.sleeptimer[:n]
+		sleeptimer[:] = np.where(still, sleeptimer+1, 0)
+		settled = (sleeptimer >= SLEEP_STEPS)
+		asleep |= settled
+		dp[settled] = 0.0
+
+		# wake anything a moving body touches
+		if (not spatialhash is None):
+			bodies = self.bodies
+			for bi in np.flatnonzero(awake & (dp != 0.0).any(axis=1)):
+				pb = bodies[bi]
+				wake_contacts(spatialhash, pb.entity, pb.rect())
+
+class ArrayPhysicsBody(PhysicsBody):
+	__slots__ = ('engine', 'slot')
+
+	def __init__(self, engine, slot, widthintiles=1, heightintiles=1):
+		self.engine = engine
+		self.slot = slot
+
+		self.entity = None
+		self.widthintiles = widthintiles
+		self.heightintiles = heightintiles
+		self.dim = (float(widthintiles*TILE_WIDTH), float(heightintiles*TILE_WIDTH))
+		self.mass = 1.0
+		self.steprect = Rect((0, 0), self.dim)
+		self.proberecth = Rect((0, 0), self.dim)
+		self.proberectv = Rect((0, 0), self.dim)
+
+	@property
+	def dp(self):
+		result = tuple(self.engine.dp[self.slot].tolist())
+		return result
+
+	@dp.setter
+	def dp(self, dp):
+		self.engine.dp[self.slot] = dp
+
+	@property
+	def dpx(self):
+		result = float(self.engine.dp[self.slot, 0])
+		return result
+
+	@dpx.setter
+	def dpx(self, dpx):
+		self.engine.dp[self.slot, 0] = dpx
+
+	@property
+	def dpy(self):
+		result = float(self.engine.dp[self.slot, 1])
+		return result
+
+	@dpy.setter
+	def dpy(self, dpy):
+		self.engine.dp[self.slot, 1] = dpy
+
+	def rect(self):
+		result = Rect(self.get_pos(), self.dim)
+		return result
+
+	def get_pos(self):
+		result = tuple(self.engine.pos[self.slot].tolist())
+		return result
+
+	def set_pos(self, pos):
+		self.engine.pos[self.slot] = pos
+		self.entity.x = pos[0]
+		self.entity.y = pos[1]
+		self.wake()
+
+	@property
+	def sleeping(self):
+		result = bool(self.engine.asleep[self.slot])
+		return result
+
+	def wake(self):
+		self.engine.asleep[self.slot] = False
+		self.engine.sleeptimer[self.slot] = 0
+
+	def clearforces(self):
+		self.engine.force[self.slot] = 0.0
+
+	def addforce(self, force):
+		self.engine.force[self.slot] += tuple_mult(force, TILE_WIDTH)
+
+	def addimpulse(self, impulse):
+		self.engine.dp[self.slot] += tuple_mult(impulse, TILE_WIDTH * self.engine.invmass[self.slot])
+		self.wake()
+
+	def clearcollisions(self):
+		self.engine.collisions[self.slot] = 0
+
+	def collide_up(self):
+		self.engine.collisions[self.slot, 0] += 1
+	def get_collideup(self):
+		result = int(self.engine.collisions[self.slot, 0])
+		return result
+
+	def collide_down(self):
+		self.engine.collisions[self.slot, 1] += 1
+	def get_collidedown(self):
+		result = int(self.engine.collisions[self.slot, 1])
+		return result
+
+	def collide_left(self):
+		self.engine.collisions[self.slot, 2] += 1
+	def get_collideleft(self):
+		result = int(self.engine.collisions[self.slot, 2])
+		return result
+
+	def collide_right(self):
+		self.engine.collisions[self.slot, 3] += 1
+	def get_collideright(self):
+		result = int(self.engine.collisions[self.slot, 3])
+		return result
+
+	def serialize(self):
+		engine = self.engine
+		slot = self.slot
+		result = {
+			"dp" : engine.dp[slot].tolist(),
+			"force" : engine.force[slot].tolist(),
+			"collisions" : engine.collisions[slot].tolist(),
+			"sleeping" : bool(engine.asleep[slot]),
+			"sleeptimer" : int(engine.sleeptimer[slot]),
+			"restforce" : engine.restforce[slot].tolist(),
+		}
+		return result
+
+	def load(self, data):
+		engine = self.engine
+		slot = self.slot
+		engine.dp[slot] = data["dp"]
+		engine.force[slot] = data["force"]
+		engine.collisions[slot] = data["collisions"]
+		engine.asleep[slot] = data["sleeping"]
+		engine.sleeptimer[slot] = data["sleeptimer"]
+		engine.restforce[slot] = data["restforce"]
+
+'''
+Particles and projectiles for spells. Every particle is a slot in a set of
+numpy arrays (position, velocity, remaining life, gravity scale, element), so
+a burst of 200 is one emit call and never makes an Entity.
+
+Slots are pooled: dead ones are reused by the next emit, and the arrays only
+grow (doubling) when every slot is live. update() integrates, checks the
+tile each particle is in against the collision grid and expires particles
+for all live slots at once. Anything that runs into geometry dies.
+draw() does every visible particle with one screen.blits call.
+'''
+class ParticleSystem:
+	def __init__(self, capacity=PARTICLE_CAPACITY):
+		assert(not np is None)
+
+		self.capacity = 0
+		self.pos = np.zeros((0, 2))
+		self.vel = np.zeros((0, 2))
+		self.life = np.zeros(0)
+		self.gravity = np.zeros(0)
+		self.element = np.zeros(0, dtype=np.int8)
+		self.alive = np.zeros(0, dtype=bool)
+		self.reserve(capacity)
+
+		self.geometry = None
+		self.geogrid = None
+		self.geoversion = 0
+
+		self.images = {} # (element, zoom) -> Surface
+		self.rng = np.random.default_rng()
+
+	def reserve(self, capacity):
+		if (capacity <= self.capacity):
+			return
+
+		self.pos = self.grow_array(self.pos, capacity)
+		self.vel = self.grow_array(self.vel, capacity)
+		self.life = self.grow_array(self.life, capacity)
+		self.gravity = self.grow_array(self.gravity, capacity)
+		self.element = self.grow_array(self.element, capacity)
+		self.alive = self.grow_array(self.alive, capacity)
+		self.capacity = capacity
+
+	def grow_array(self, array, capacity):
+		# live slots can be anywhere, so copy the lot
+		result = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+		result[:self.capacity] = array
+		return result
+
+	def get_numlive(self):
+		result = int(np.count_nonzero(self.alive))
+		return result
+
+	# positions and velocities are (n, 2), in world coords. returns the slots used.
+	def emit(self, positions, velocities, life, element, gravity=1.0):
+		positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+		n = len(positions)
+
+		free = np.flatnonzero(~self.alive)
+		if (len(free) < n):
+			self.reserve(max(self.capacity*2, self.capacity + n))
+			free = np.flatnonzero(~self.alive)
+		slots = free[:n]
+
+		self.pos[slots] = positions
+		self.vel[slots] = velocities
+		self.life[slots] = life
+		self.gravity[slots] = gravity
+		self.element[slots] = element
+		self.alive[slots] = True
+
+		result = slots
+		return result
+
+	# count particles flying out of pos in every direction
+	def emit_burst(self, pos, count, speed, life, element, gravity=1.0):
+		angle = self.rng.uniform(0.0, 2*np.pi, count)
+		speeds = speed * self.rng.uniform(0.5, 1.0, count)
+		velocities = np.stack((np.cos(angle)*speeds, np.sin(angle)*speeds), axis=1)
+		lives = life * self.rng.uniform(0.5, 1.0, count)
+		positions = np.tile(np.asarray(pos, dtype=float), (count, 1))
+
+		result = self.emit(positions, velocities, lives, element, gravity)
+		return result
+
+	def update(self, geometry, dt=PHYSICS_TIME_STEP):
+		live = np.flatnonzero(self.alive)
+		if (len(live) == 0):
+			return
+
+		if (not geometry is self.geometry or geometry.geoversion != self.geoversion):
+			self.geogrid = get_geogrid(geometry)
+			self.geometry = geometry
+			self.geoversion = geometry.geoversion
+
+		vel = self.vel[live]
+		vel[:, 1] += PARTICLE_GRAVITY * self.gravity[live] * dt
+		pos = self.pos[live] + vel * dt
+		life = self.life[live] - dt
+		self.vel[live] = vel
+		self.pos[live] = pos
+		self.life[live] = life
+
+		# tile each particle is in, off the map never collides
+		tile = (pos // TILE_WIDTH).astype(np.int64)
+		tx = tile[:, 0]
+		ty = tile[:, 1]
+		onmap = (tx >= 0) & (ty >= 0) & (tx < geometry.width) & (ty < geometry.height)
+		hit = np.zeros(len(live), dtype=bool)
+		hit[onmap] = self.geogrid[ty[onmap], tx[onmap]]
+
+		self.alive[live[(life <= 0.0) | hit]] = False
+
+	def get_image(self, element, zoom):
+		key = (element, zoom)
+		result = self.images.get(key)
+		if (result is None):
+			size = max(1, int(PARTICLE_SIZE * zoom))
+			result = pygame.Surface((size, size))
+			result.fill(element_colors.get(element, grey))
+			self.images[key] = result
+		return result
+
+	# returns the rects blitted to
+	def draw(self, screen, camera):
+		live = np.flatnonzero(self.alive)
+		if (len(live) == 0):
+			return []
+
+		# same rounding as Camera.game2screen, centered on the particle
+		zoom = camera.renderzoom
+		half = PARTICLE_SIZE * zoom / 2
+		screenpos = ((self.pos[live] - camera.pos) * zoom + 0.5 - half).astype(np.int64)
+		width, height = screen.get_size()
+		visible = (
+			(screenpos[:, 0] > -2*half) & (screenpos[:, 1] > -2*half) &
+			(screenpos[:, 0] < width) & (screenpos[:, 1] < height))
+
+		images = {}
+		for element in element_colors:
+			images[element] = self.get_image(element, zoom)
+
+		blits = []
+		for element, x, y in zip(
+			self.element[live[visible]].tolist(),
+			screenpos[visible, 0].tolist(),
+			screenpos[visible, 1].tolist()):
+			image = images.get(element)
+			if (image is None):
+				image = self.get_image(element, zoom)
+			blits.append((image, (x, y)))
+
+		result = screen.blits(blits)
+		return result
+
+class EntityLoader:
+	def __init__(self, spritebatch):
+		fin = open('./data/entitydata.json')
+		self.entitydata = json.load(fin)
+		fin.close()
+
+		self.spritebatch = spritebatch
+
+	def create_entity(self, ename, position=(0,0)):
+		assert(ename in self.entitydata)
+
+		position = position
+
+		edata = self.entitydata[ename]
 		
 		spritedata = edata["spritedata"]
 		physicsdata = edata["physicsdata"]
@@ -802,8 +2913,84 @@ e.g. when the creature is killed, just set the ID to None to turn it off. Don't
 component logic on entities without IDs.
 '''
 
+'''
+The arena part of the TODO above. Entities sit in slots and are referred to by
+integer IDs that pack the slot with a generation counter. Removing an entity
+switches its slot off and bumps the generation, so stale IDs stop resolving,
+and the next add reuses the slot. live is kept in slot order and is the only
+thing the game loop iterates.
+'''
+class EntityArena:
+	def __init__(self):
+		self.slots = [] # entity or None
+		self.generations = []
+		self.freeslots = []
+		self.liveslots = [] # sorted
+		self.live = [] # entities of liveslots, same order
+
+	def get_slot(self, eid):
+		result = eid & ((1 << ENTITYID_SLOTBITS) - 1)
+		return result
+
+	def get_generation(self, eid):
+		result = eid >> ENTITYID_SLOTBITS
+		return result
+
+	def add(self, entity):
+		if (len(self.freeslots) > 0):
+			# reuse the lowest free slot so the arena stays packed
+			slot = heappop(self.freeslots)
+		else:
+			slot = len(self.slots)
+			self.slots.append(None)
+			self.generations.append(0)
+
+		# past this the slot would spill into the generation bits of the id
+		assert(slot < 1 << ENTITYID_SLOTBITS)
+
+		self.slots[slot] = entity
+		entity.id = (self.generations[slot] << ENTITYID_SLOTBITS) | slot
+
+		li = bisect_left(self.liveslots, slot)
+		self.liveslots.insert(li, slot)
+		self.live.insert(li, entity)
+
+		result = entity.id
+		return result
+
+	def remove(self, eid):
+		entity = self.get(eid)
+		assert(not entity is None)
+
+		slot = self.get_slot(eid)
+		self.slots[slot] = None
+		self.generations[slot] += 1
+		heappush(self.freeslots, slot)
+
+		li = bisect_left(self.liveslots, slot)
+		del self.liveslots[li]
+		del self.live[li]
+
+		entity.id = None
+
+	# None if the entity has been removed, even if its slot has been reused
+	def get(self, eid):
+		slot = self.get_slot(eid)
+		result = None
+		if (slot < len(self.slots) and self.generations[slot] == self.get_generation(eid)):
+			result = self.slots[slot]
+		return result
+
+	def has(self, eid):
+		result = (not self.get(eid) is None)
+		return result
+
 class Entity:
+	__slots__ = ('id', 'x', 'y', 'facing_direction', 'physics', 'player', 'animator')
+
 	def __init__(self, position=(0, 0), physics=None, spriteindex=None, animator=None, player=None):
+		self.id = None # set by EntityArena
+
 		# common state vars
 		self.x, self.y = position
 		self.facing_direction = 1 # TODO: encode starting facing dir in spawn_loc on map
@@ -827,6 +3014,8 @@ class Entity:
 		return result
 
 class StaticAnimator:
+	__slots__ = ('entity', 'spriteindex')
+
 	def __init__(self, spriteindex):
 		self.entity = None
 		self.spriteindex = spriteindex
@@ -839,13 +3028,20 @@ class StaticAnimator:
 		return blit
 
 class Player:
+	__slots__ = (
+		'entity', 'jumps_remaining', 'jump_timer', 'fall_timer', 'attack_timer',
+		'prevjump', 'prevatk', 'atkexecuted', 'max_mana', 'curr_mana',
+		'time_between_recover_mana', 'time_until_recover_mana',
+		'time_remaining_to_recover', 'magic_soul', 'magic_body', 'magic_mind',
+		'last_element', 'spells_used', 'spells_used_len', 'combos')
+
 	def __init__(self):
 		self.entity = None
 
 		# movement input stuff
 		self.jumps_remaining = 0
 		self.jump_timer = 0.0
-		self.fall_timer = 0
+		self.fall_timer = 0.0
 		self.attack_timer = 0
 
 		self.prevjump = False
@@ -865,6 +3061,11 @@ class Player:
 		self.magic_mind = E_FIRE
 
 		self.last_element = -1
+		self.spells_used = []
+		self.spells_used_len = 0
+
+		# spell motions
+		self.combos = ComboMatcher(spell_combotrie)
 
 	def get_pos(self):
 		result = self.entity.physics.get_pos()
@@ -873,15 +3074,54 @@ class Player:
 	def set_pos(self, pos):
 		self.entity.physics.set_pos(pos)
 
-def player_update(player):
+	def serialize(self):
+		result = {
+			"jumps_remaining" : self.jumps_remaining,
+			"jump_timer" : self.jump_timer,
+			"fall_timer" : self.fall_timer,
+			"attack_timer" : self.attack_timer,
+			"prevjump" : self.prevjump,
+			"prevatk" : self.prevatk,
+			"atkexecuted" : self.atkexecuted,
+			"curr_mana" : self.curr_mana,
+			"time_remaining_to_recover" : self.time_remaining_to_recover,
+			"magic_soul" : self.magic_soul,
+			"magic_body" : self.magic_body,
+			"magic_mind" : self.magic_mind,
+			"last_element" : self.last_element,
+			"spells_used" : list(self.spells_used),
+			"spells_used_len" : self.spells_used_len,
+			"combos" : self.combos.serialize(),
+		}
+		return result
+
+	def load(self, data):
+		self.jumps_remaining = data["jumps_remaining"]
+		self.jump_timer = data["jump_timer"]
+		self.fall_timer = data["fall_timer"]
+		self.attack_timer = data["attack_timer"]
+		self.prevjump = data["prevjump"]
+		self.prevatk = data["prevatk"]
+		self.atkexecuted = data["atkexecuted"]
+		self.curr_mana = data["curr_mana"]
+		self.time_remaining_to_recover = data["time_remaining_to_recover"]
+		self.magic_soul = data["magic_soul"]
+		self.magic_body = data["magic_body"]
+		self.magic_mind = data["magic_mind"]
+		self.last_element = data["last_element"]
+		self.spells_used = list(data["spells_used"])
+		self.spells_used_len = data["spells_used_len"]
+		self.combos.load(data["combos"])
+
+def player_update(player, dt=PHYSICS_TIME_STEP):
 	# add physics forces (movement force handled in input handling)
 	gravity = (0, GRAVITY_ACCEL)
 	player.entity.physics.addforce(gravity)
 
 	# apply friction
 	fric = (
-		-1*sign(player.entity.physics.dp[0])*(player.entity.physics.dp[0]**2)*HORZ_FRIC, 
-		-1*sign(player.entity.physics.dp[1])*(player.entity.physics.dp[1]**2)*VERT_FRIC
+		-1*sign(player.entity.physics.dpx)*(player.entity.physics.dpx**2)*HORZ_FRIC, 
+		-1*sign(player.entity.physics.dpy)*(player.entity.physics.dpy**2)*VERT_FRIC
 	)
 	player.entity.physics.addforce(fric)
 
@@ -899,14 +3139,14 @@ def player_update(player):
 				else:
 					player.jumps_remaining = 1
 				player.jump_timer = 0.0
-				player.fall_timer = 0
+				player.fall_timer = 0.0
 		else:
-			player.jump_timer += PHYSICS_TIME_STEP
+			player.jump_timer += dt
 
 	# coyote time only occurs at max jumps (walking off a surface)
 	elif (not player.entity.physics.get_collidedown()):
-		player.fall_timer += 1 # depends on FPS
-		if (player.fall_timer >= COYOTE_FRAMES):
+		player.fall_timer += dt
+		if (player.fall_timer >= COYOTE_SEC):
 			if (player.magic_soul == E_WIND):
 				player.jumps_remaining = 1
 			else:
@@ -914,7 +3154,7 @@ def player_update(player):
 
 	# handle magic and stamina
 	if (player.curr_mana < player.max_mana):
-		player.time_remaining_to_recover -= PHYSICS_TIME_STEP
+		player.time_remaining_to_recover -= dt
 		if (player.time_remaining_to_recover < 0.0):
 			player.spells_used = []
 			player.spells_used_len = 0
@@ -923,7 +3163,19 @@ def player_update(player):
 				player.curr_mana += 1
 				return '+'
 
-def player_handleinput(playerentity, inputdata):
+# returns whether there was the mana for it
+def player_castspell(player, element):
+	if (player.curr_mana <= 0):
+		return False
+
+	player.curr_mana -= 1
+	player.time_remaining_to_recover = player.time_until_recover_mana
+	player.spells_used.append(element)
+	player.spells_used_len += 1
+	player.last_element = element
+	return True
+
+def player_handleinput(playerentity, inputdata, dt=PHYSICS_TIME_STEP):
 	output = []
 
 	player = playerentity.player
@@ -955,8 +3207,9 @@ def player_handleinput(playerentity, inputdata):
 			pass
 		else:
 			playerentity.physics.halt_vert_vel()
-			force = (0, -JUMP_ACCEL)
-			playerentity.physics.addforce(force)
+			# as much as JUMP_ACCEL over one step at 100 Hz, whatever the step is
+			impulse = (0, -JUMP_ACCEL * PHYSICS_TIME_STEP)
+			playerentity.physics.addimpulse(impulse)
 			playerentity.player.jumps_remaining -= 1
 
 	# attacking
@@ -964,33 +3217,37 @@ def player_handleinput(playerentity, inputdata):
 			# start attack on new button press
 			playerentity.player.atkexecuted = False
 			playerentity.player.attack_timer = 0.0
-			print("winding up attack")
 	elif (playerentity.player.attack_timer > HOLDBUTTONTIMESHORT and 
 		not player.atkexecuted):
 		# after holding the button sufficiently long, transition to heavy attack
 		playerentity.player.atkexecuted = True
-		print("heavy attack")
-		print()
-	elif (player.prevatk and not attack):
+		playerentity.player.attack_timer = attack_stats[AttackKind.HEAVY][0]
+		output.append(AttackKind.HEAVY)
+	elif (player.prevatk and not attack and not player.atkexecuted):
 		if (player.attack_timer < HOLDBUTTONTIMESHORT):
 			# on button release before hold, transition to light attack
 			playerentity.player.atkexecuted = True
-			print("light attack")
-			print()	
+			playerentity.player.attack_timer = attack_stats[AttackKind.LIGHT][0]
+			output.append(AttackKind.LIGHT)
 
 	if (player.prevatk and not player.atkexecuted):
-		playerentity.player.attack_timer += PHYSICS_TIME_STEP
+		# winding up
+		playerentity.player.attack_timer += dt
+	elif (player.atkexecuted and player.attack_timer > 0.0):
+		# swinging, the attack's hitbox is out until this runs down
+		playerentity.player.attack_timer = max(player.attack_timer - dt, 0.0)
 			
 
 	# dodging
 
 	# ducking & sliding
 
-	# check for spells
-	'''
-	DOWN -> DOWN_DIR -> DIR -> ATTACK
-	UP -> UP_DIR -> DIR -> ATTACK
-	'''
+	# check for spells, see spell_combos
+	for spell, facing in player.combos.update(inputdata):
+		if (spell == SpellMotion.BODY):
+			player_castspell(player, player.magic_body)
+		else:
+			player_castspell(player, player.magic_mind)
 
 	# set prev inputs
 	playerentity.player.prevjump = jump
@@ -1015,15 +3272,100 @@ class InputDataIndex(IntEnum):
 	JUMP = 2
 	ATTACK = 3
 
+'''
+What's held down on the keyboard and joystick, as of the last poll. main()
+empties the event queue once per frame into this, and the first physics step
+after that reads it through InputDataBuffer.newinput. pygame events don't
+have timestamps, so everything polled in a frame counts from that step on.
+
+A key or button that went down and came back up within one poll still
+counts as held for one step, so short taps aren't lost.
+'''
+class InputState:
+	def __init__(self):
+		self.keys = set()
+		self.buttons = set() # joystick
+		self.hat = (0, 0) # joystick hat 0
+		self.tappedkeys = set()
+		self.tappedbuttons = set()
+
+	# returns whether the game should quit
+	def poll(self, events):
+		result = False
+		for event in events:
+			if (event.type == pygame.KEYDOWN):
+				self.keys.add(event.key)
+				self.tappedkeys.add(event.key)
+			elif (event.type == pygame.KEYUP):
+				self.keys.discard(event.key)
+			elif (event.type == pygame.JOYBUTTONDOWN):
+				self.buttons.add(event.button)
+				self.tappedbuttons.add(event.button)
+			elif (event.type == pygame.JOYBUTTONUP):
+				self.buttons.discard(event.button)
+			elif (event.type == pygame.JOYHATMOTION):
+				if (event.hat == 0):
+					self.hat = event.value
+			elif (event.type == pygame.QUIT):
+				result = True
+
+		if (self.get_key(pygame.K_ESCAPE) or self.get_button(6)):
+			result = True
+		return result
+
+	def get_key(self, key):
+		result = (key in self.keys or key in self.tappedkeys)
+		return result
+
+	def get_button(self, button):
+		result = (button in self.buttons or button in self.tappedbuttons)
+		return result
+
+	# after a step has read the taps
+	def clear_taps(self):
+		self.tappedkeys.clear()
+		self.tappedbuttons.clear()
+
+'''
+Ring buffer of the last maxqueuelength frames of input vars. A new frame
+writes over the oldest one instead of shifting every var's list. For every
+var, lastseen has the last frame number each value was set in, so had_var()
+is a lookup instead of a scan back through the frames. Setting a var again
+in the same frame puts back the lastseen of the value it replaces.
+'''
 class InputDataBuffer:
 	def __init__(self):
+		self.maxqueuelength = MAXINPUTQUEUELEN
 		self.queuelength = 0
+		self.framenum = -1 # counts up forever, unlike head
+		self.head = -1 # current frame in the ring
 
 		self.vars = []
+		self.lastseen = [] # value -> framenum
+		self.replaced = [] # lastseen of each var's current value before this frame
 
 		# append in order of input data index enum
 		for inputtype in InputDataIndex:
-			self.vars.append([])
+			self.vars.append([0]*self.maxqueuelength)
+			self.lastseen.append({})
+			self.replaced.append(None)
+
+	# start a new frame with default values
+	def push(self):
+		self.framenum += 1
+		self.head += 1
+		if (self.head == self.maxqueuelength):
+			self.head = 0
+		if (self.queuelength < self.maxqueuelength):
+			self.queuelength += 1
+
+		framenum = self.framenum
+		head = self.head
+		for vi in range(len(self.vars)):
+			self.vars[vi][head] = 0
+			lastseen = self.lastseen[vi]
+			self.replaced[vi] = lastseen.get(0)
+			lastseen[0] = framenum
 
 	''' 
 	~ joystick event info ~
@@ -1034,59 +3376,35 @@ class InputDataBuffer:
 	JOYBUTTONDOWN     joy, button
 	'''
 
-	def newinput(self, curr_input):
-		if (self.queuelength == MAXINPUTQUEUELEN):
-			for varlist in self.vars:
-				varlist.pop(0)
-		else:
-			self.queuelength += 1
-
-		# put in default values
-		for varlist in self.vars:
-			varlist.append(0)
+	def newinput(self, inputstate):
+		self.push()
 
-		# movement
+		# keyboard directions, y is up like the slopes below
 		moveinputvecx, moveinputvecy = (0, 0)
-
-		# check out current input events
-		for event in curr_input:
-			# keyboard directions
-			if (event.type == pygame.KEYDOWN):
-				if event.key == pygame.K_LEFT:
-					moveinputvecx += -1
-				if event.key == pygame.K_RIGHT:
-					moveinputvecx += 1
-				if event.key == pygame.K_DOWN:
-					moveinputvecy += 1
-				if event.key == pygame.K_UP:
-					moveinputvecy += -1
-
-			# joystick directions
-			if (event.type == pygame.JOYAXISMOTION):
-				pass
-			if (event.type == pygame.JOYHATMOTION):
-				if event.hat == 0:
-					# haven't checked whether y-value is good on this
-					moveinputvecx, moveinputvecy = event.value
-
-			if (event.type == pygame.KEYDOWN):
-				# jumping
-				if event.key == pygame.K_SPACE:
-					self.set_var(InputDataIndex.JUMP, 1)
-
-				# guarding & attacking
-				'''
-				if event.key == pygame.K_g:
-					self.set_var(InputDataIndex.GUARD, 1)
-				'''
-				if event.key == pygame.K_f:
-					self.set_var(InputDataIndex.ATTACK, 1)
-
-			# more joystick actions
-			if (event.type == pygame.JOYBUTTONDOWN):
-				# jumping & dodging
-				if event.button == 0:
-					self.set_var(InputDataIndex.JUMP, 1)
+		if (inputstate.get_key(pygame.K_LEFT)):
+			moveinputvecx += -1
+		if (inputstate.get_key(pygame.K_RIGHT)):
+			moveinputvecx += 1
+		if (inputstate.get_key(pygame.K_DOWN)):
+			moveinputvecy += -1
+		if (inputstate.get_key(pygame.K_UP)):
+			moveinputvecy += 1
+
+		# joystick directions, hat y is already up
+		if (inputstate.hat != (0, 0)):
+			moveinputvecx, moveinputvecy = inputstate.hat
+
+		# jumping
+		if (inputstate.get_key(pygame.K_SPACE) or inputstate.get_button(0)):
+			self.set_var(InputDataIndex.JUMP, 1)
+
+		# guarding & attacking
+		'''
+		if (inputstate.get_key(pygame.K_g)):
+			self.set_var(InputDataIndex.GUARD, 1)
+		'''
+		if (inputstate.get_key(pygame.K_f)):
+			self.set_var(InputDataIndex.ATTACK, 1)
 
 		# discrete thumbstick/keyboard directions
 		if moveinputvecx > 0:
@@ -1118,24 +3436,299 @@ class InputDataBuffer:
 				self.set_var(InputDataIndex.MOVE_DIR, InputMoveDir.DOWN)
 				self.set_var(InputDataIndex.DUCK, 1)
 		else:
-			if moveinputvecy > 0:
+			if moveinputvecy < 0:
 				self.set_var(InputDataIndex.MOVE_DIR, InputMoveDir.DOWN)
 				self.set_var(InputDataIndex.DUCK, 1)
-			elif moveinputvecy < 0:
+			elif moveinputvecy > 0:
 				self.set_var(InputDataIndex.MOVE_DIR, InputMoveDir.UP)
 
 	def set_var(self, var_idi, val):
-		self.vars[var_idi][self.queuelength-1] = val
+		varlist = self.vars[var_idi]
+		old = varlist[self.head]
+		if (old != val):
+			# this frame doesn't have old anymore
+			lastseen = self.lastseen[var_idi]
+			replaced = self.replaced[var_idi]
+			if (replaced is None):
+				del lastseen[old]
+			else:
+				lastseen[old] = replaced
+
+			self.replaced[var_idi] = lastseen.get(val)
+			lastseen[val] = self.framenum
+			varlist[self.head] = val
 		return val
 
 	def get_var(self, var_idi):
-		result = self.vars[var_idi][self.queuelength-1]
+		result = self.vars[var_idi][self.head]
+		return result
+
+	# whether var was val in any of the last frames frames, this one included
+	def had_var(self, var_idi, val, frames=MAXINPUTQUEUELEN):
+		assert(frames > 0)
+		frames = min(frames, self.queuelength)
+		seen = self.lastseen[var_idi].get(val)
+		result = (not seen is None and seen > self.framenum-frames)
+		return result
+
+	def serialize(self):
+		result = {
+			"queuelength" : self.queuelength,
+			"framenum" : self.framenum,
+			"head" : self.head,
+			"vars" : [list(varlist) for varlist in self.vars],
+			"lastseen" : [list(lastseen.items()) for lastseen in self.lastseen],
+			"replaced" : list(self.replaced),
+		}
+		return result
+
+	def load(self, data):
+		self.queuelength = data["queuelength"]
+		self.framenum = data["framenum"]
+		self.head = data["head"]
+		self.vars = [list(varlist) for varlist in data["vars"]]
+		self.lastseen = [dict(items) for items in data["lastseen"]]
+		self.replaced = list(data["replaced"])
+
+# what a combo is made of. DIR is the way the combo is aimed, so combos with
+# it match both ways round
+class ComboStep(IntEnum):
+	DOWN = 0
+	UP = 1
+	DIR = 2
+	DOWN_DIR = 3
+	UP_DIR = 4
+	ATTACK = 5
+	JUMP = 6
+
+# (InputDataIndex, value) a step is, aimed facing (1 right, -1 left)
+def get_combosymbol(step, facing):
+	if (step == ComboStep.DOWN):
+		result = (InputDataIndex.MOVE_DIR, InputMoveDir.DOWN)
+	elif (step == ComboStep.UP):
+		result = (InputDataIndex.MOVE_DIR, InputMoveDir.UP)
+	elif (step == ComboStep.DIR):
+		if (facing > 0):
+			result = (InputDataIndex.MOVE_DIR, InputMoveDir.RIGHT)
+		else:
+			result = (InputDataIndex.MOVE_DIR, InputMoveDir.LEFT)
+	elif (step == ComboStep.DOWN_DIR):
+		if (facing > 0):
+			result = (InputDataIndex.MOVE_DIR, InputMoveDir.DOWN_RIGHT)
+		else:
+			result = (InputDataIndex.MOVE_DIR, InputMoveDir.DOWN_LEFT)
+	elif (step == ComboStep.UP_DIR):
+		if (facing > 0):
+			result = (InputDataIndex.MOVE_DIR, InputMoveDir.UP_RIGHT)
+		else:
+			result = (InputDataIndex.MOVE_DIR, InputMoveDir.UP_LEFT)
+	elif (step == ComboStep.ATTACK):
+		result = (InputDataIndex.ATTACK, 1)
+	else:
+		result = (InputDataIndex.JUMP, 1)
+	return result
+
+class ComboNode:
+	__slots__ = ('children', 'accepts', 'maxwindow')
+
+	def __init__(self):
+		self.children = {} # symbol -> [(window, ComboNode), ...]
+		self.accepts = [] # (name, facing) of the combos that end here
+		self.maxwindow = 0 # longest a partial match here can wait for its next step
+
+	def get_child(self, symbol, window):
+		children = self.children.get(symbol)
+		if (children is None):
+			children = []
+			self.children[symbol] = children
+		for childwindow, child in children:
+			if (childwindow == window):
+				return child
+
+		result = ComboNode()
+		children.append((window, result))
+		self.maxwindow = max(self.maxwindow, window)
+		return result
+
+'''
+Compiles combos, a list of (name, steps) or (name, steps, window), into one
+trie of input symbols that every ComboMatcher can share. Each step has to
+come within window frames of the one before it. Combos with a DIR step go in
+once aimed right and once aimed left, the rest once with facing 0. Combos
+that start the same way share nodes until they don't.
+'''
+def compile_combos(combos):
+	root = ComboNode()
+	for combo in combos:
+		name = combo[0]
+		steps = combo[1]
+		window = COMBO_STEP_FRAMES
+		if (len(combo) > 2):
+			window = combo[2]
+
+		aimed = any(step in (ComboStep.DIR, ComboStep.DOWN_DIR, ComboStep.UP_DIR) for step in steps)
+		facings = (0,)
+		if (aimed):
+			facings = (1, -1)
+
+		for facing in facings:
+			node = root
+			for step in steps:
+				node = node.get_child(get_combosymbol(step, facing), window)
+			node.accepts.append((name, facing))
+	return root
+
+'''
+Recognizes combos for one player against a compiled trie. update() goes
+once per newinput: every var that has changed to something other than 0 is
+a symbol, and each symbol moves the partial matches that can take it one
+node on (and starts new ones from the root). Partial matches that wait too
+long for their next step are dropped. Symbols that no combo wants next
+don't break a partial match, so e.g. ducking between motion inputs is fine.
+
+The work per update is in the partial matches that are live, not in how
+many combos there are.
+'''
+class ComboMatcher:
+	def __init__(self, root):
+		self.root = root
+		self.active = {} # ComboNode -> framenum it was reached
+		self.prevvars = [0]*len(InputDataIndex)
+		self.matches = []
+
+	# returns (name, facing) of every combo finished this frame, reused
+	def update(self, inputdata):
+		matches = self.matches
+		matches.clear()
+
+		framenum = inputdata.framenum
+		prevvars = self.prevvars
+		for vi in range(len(prevvars)):
+			val = inputdata.get_var(vi)
+			if (val == prevvars[vi]):
+				continue
+			prevvars[vi] = val
+			if (val != 0):
+				self.advance((vi, val), framenum)
+
+		active = self.active
+		if (len(active) > 0):
+			expired = [node for node, frame in active.items() if framenum-frame > node.maxwindow]
+			for node in expired:
+				del active[node]
+
+		result = matches
+		return result
+
+	def advance(self, symbol, framenum):
+		active = self.active
+		reached = []
+		for window, child in self.root.children.get(symbol, ()):
+			reached.append(child)
+		for node, frame in active.items():
+			for window, child in node.children.get(symbol, ()):
+				if (framenum-frame <= window):
+					reached.append(child)
+
+		for node in reached:
+			if (len(node.children) > 0):
+				active[node] = framenum
+			self.matches.extend(node.accepts)
+
+	# every node in the same order every time, so they can be saved as indices
+	def get_nodes(self):
+		result = []
+		stack = [self.root]
+		while (len(stack) > 0):
+			node = stack.pop()
+			result.append(node)
+			for children in node.children.values():
+				for window, child in children:
+					stack.append(child)
+		return result
+
+	def serialize(self):
+		nodes = self.get_nodes()
+		nodeindex = {}
+		for ni in range(len(nodes)):
+			nodeindex[nodes[ni]] = ni
+
+		result = {
+			"prevvars" : list(self.prevvars),
+			"active" : [[nodeindex[node], frame] for node, frame in self.active.items()],
+		}
+		return result
+
+	def load(self, data):
+		nodes = self.get_nodes()
+		self.prevvars = list(data["prevvars"])
+		self.active = {}
+		for ni, frame in data["active"]:
+			self.active[nodes[ni]] = frame
+
+class SpellMotion(IntEnum):
+	BODY = 0
+	MIND = 1
+
+spell_combos = [
+	(SpellMotion.BODY, (ComboStep.DOWN, ComboStep.DOWN_DIR, ComboStep.DIR, ComboStep.ATTACK)),
+	(SpellMotion.MIND, (ComboStep.UP, ComboStep.UP_DIR, ComboStep.DIR, ComboStep.ATTACK)),
+]
+spell_combotrie = compile_combos(spell_combos)
+
+def load_image(filename):
+	result = pygame.image.load(filename)
+	# match the display format so blits don't convert pixels every time
+	if (not pygame.display.get_surface() is None):
+		result = result.convert_alpha()
+	return result
+
+'''
+Atlases are packed offline by atlasbuilder.py. Each atlas image is loaded
+once and sprites are subsurfaces of it, so they share its pixels.
+Sprites missing from the manifest (e.g. added since the last build) are just
+loaded from their own files, and so is every sprite when spritedata.json
+doesn't hash to what it did when the atlas was built. That's checked once here,
+no sprite png gets opened for it.
+'''
+class TextureAtlas:
+	def __init__(self, filename=ATLASDATA_FILE, spritedatahash=None):
+		self.atlasdata = {"atlases" : {}, "sprites" : {}}
+		if (os.path.exists(filename)):
+			fin = open(filename)
+			atlasdata = json.load(fin)
+			fin.close()
+			if (spritedatahash is None or atlasdata.get("spritedata") == spritedatahash):
+				self.atlasdata = atlasdata
+
+		self.images = {} # atlas num -> loaded atlas image
+
+	def has(self, name):
+		result = (name in self.atlasdata["sprites"])
+		return result
+
+	def get_image(self, name):
+		sdata = self.atlasdata["sprites"][name]
+		atlasnum = sdata["atlas"]
+
+		if (not atlasnum in self.images):
+			self.images[atlasnum] = load_image(self.atlasdata["atlases"][atlasnum]["file"])
+
+		result = self.images[atlasnum].subsurface(
+			pygame.Rect(
+				(int(sdata["x"]), int(sdata["y"])),
+				(int(sdata["width"]), int(sdata["height"]))
+			)
+		)
 		return result
 
 class SpriteSheet:
-	def __init__(self, data, name):
+	def __init__(self, data, name, atlas=None):
 		self.name = name
-		self.image = pygame.image.load(data[name]['file'])
+		if (not atlas is None and atlas.has(name)):
+			self.image = atlas.get_image(name)
+		else:
+			self.image = load_image(data[name]['file'])
 
 		# use this var to determine when to unload
 		self.numloadedmapsusing = 1
@@ -1150,13 +3743,23 @@ class SpriteSheet:
 
 # one spritebatch for animated sprites, one for not (i.e. geometry)
 class SpriteBatch:
-	def __init__(self):
+	def __init__(self, scalecachebudget=SCALECACHE_BUDGET_BYTES):
 		self.length = 0
 		self.sprites = []
 
-		fin = open('./data/graphics/spritedata.json')
-		self.spritedata = json.load(fin)
+		fin = open('./data/graphics/spritedata.json', 'rb')
+		spritedatabytes = fin.read()
 		fin.close()
+		self.spritedata = json.loads(spritedatabytes)
+
+		self.atlas = TextureAtlas(spritedatahash=hashlib.sha1(spritedatabytes).hexdigest())
+
+		# scaled (and flipped) images, keyed by (spriteindex, scale, fliphorz).
+		# least recently drawn first, so eviction pops from the front.
+		self.scalecache = OrderedDict()
+		self.scalecachebytes = 0
+		self.scalecachebudget = scalecachebudget
+		self.scalecachezoom = None
 
 	def get(self, spriteindex):
 		if (spriteindex >= self.length):
@@ -1179,7 +3782,7 @@ class SpriteBatch:
 				self.sprites[i].numloadedmapsusing += 1
 		if (result < 0):
 			# load the new sprite in
-			newspritesheet = SpriteSheet(self.spritedata, spritename)
+			newspritesheet = SpriteSheet(self.spritedata, spritename, self.atlas)
 			self.sprites.append(newspritesheet)
 			result = self.length
 			self.length += 1
@@ -1190,45 +3793,282 @@ class SpriteBatch:
 		# check numloadedmapsusing -- if zero, then unload
 		pass
 
+	def set_zoom(self, zoom):
+		# cached images were scaled for the old zoom, so throw them all out
+		if (zoom != self.scalecachezoom):
+			self.clear_scalecache()
+			self.scalecachezoom = zoom
+
+	def clear_scalecache(self):
+		self.scalecache.clear()
+		self.scalecachebytes = 0
+
+	def get_scaledimage(self, spriteindex, scale, fliphorz=False):
+		key = (spriteindex, scale, fliphorz)
+		result = self.scalecache.get(key)
+
+		if (result is None):
+			result = pygame.transform.scale(self.sprites[spriteindex].get_image(), scale)
+			if (fliphorz):
+				result = pygame.transform.flip(result, True, False)
+
+			self.scalecache[key] = result
+			self.scalecachebytes += result.get_width() * result.get_height() * result.get_bytesize()
+
+			# evict least recently used images until back under budget,
+			# but always keep the one we just made
+			while (self.scalecachebytes > self.scalecachebudget and len(self.scalecache) > 1):
+				oldkey, oldimage = self.scalecache.popitem(last=False)
+				self.scalecachebytes -= oldimage.get_width() * oldimage.get_height() * oldimage.get_bytesize()
+		else:
+			self.scalecache.move_to_end(key)
+
+		return result
+
 	def draw(self, spriteindex, rect, fliphorz=False):
-		image = self.sprites[spriteindex].get_image()
 		# scale image to the rect (already zoomed)
 		scale = rect.get_dim()
-		image = pygame.transform.scale(image, scale)
-
-		result = None
-
-		if (fliphorz):
-			image = pygame.transform.flip(image, True, False)
-			result = (image, rect.get_pyrect())
-		else:
-			result = (image, rect.get_pyrect())
-
+		image = self.get_scaledimage(spriteindex, scale, fliphorz)
+		result = (image, rect.get_pyrect())
 		return result
 
-# use for multiplayer
+'''
+use for multiplayer
+
+entities is the arena's live list itself, not a copy, so adding or removing
+an entity while looping over it skips or repeats one. Loop over
+list(worldstate.entities) for that, or gather the ids and remove them after.
+'''
 class WorldState:
-	def __init__(self):
+	def __init__(self, physicsarrays=None):
+		self.arena = EntityArena()
+		# live entities in slot order, same list as arena.live
+		self.entities = self.arena.live
 		self.numentities = 0
-		self.entities = []
 
+		# broadphase over every entity with a physics body
+		self.spatialhash = SpatialHash()
+
+		# bodies move to the array engine as they're added, when it's in use
+		self.physicsarrays = physicsarrays
+
+	'''
+	Puts the state from serialize() back onto the same entities, by id. They
+	have to be in the world already: this doesn't add or remove entities.
+	'''
 	def load_ws(self, serialized_world):
-		pass
+		for data in json.loads(serialized_world):
+			e = self.arena.get(data["id"])
+			assert(not e is None)
+
+			e.facing_direction = data["facing"]
+			if (not e.physics is None):
+				e.physics.set_pos(tuple(data["pos"]))
+				e.physics.load(data["physics"])
+				self.spatialhash.update(e, e.physics.rect())
+			else:
+				e.x, e.y = data["pos"]
+
+			if (not e.player is None):
+				e.player.load(data["player"])
 
 	def serialize(self):
-		pass
+		entities = []
+		for e in self.entities:
+			data = {"id" : e.id, "facing" : e.facing_direction}
+			if (not e.physics is None):
+				# the array engine only syncs entity positions once a frame
+				data["pos"] = list(e.physics.get_pos())
+				data["physics"] = e.physics.serialize()
+			else:
+				data["pos"] = [e.x, e.y]
+
+			if (not e.player is None):
+				data["player"] = e.player.serialize()
+			entities.append(data)
+
+		result = json.dumps(entities)
+		return result
 
 	def add_entity(self, e):
-		self.entities.append(e)
+		result = self.arena.add(e)
 		self.numentities += 1
+		if (not e.physics is None):
+			if (not self.physicsarrays is None):
+				self.physicsarrays.add_entity(e)
+			self.spatialhash.insert(e, e.physics.rect())
+		return result
+
+	def remove_entity(self, eid):
+		e = self.arena.get(eid)
+		if (self.spatialhash.has(e)):
+			self.spatialhash.remove(e)
+		if (not self.physicsarrays is None and not e.physics is None):
+			self.physicsarrays.remove_entity(e)
+		self.arena.remove(eid)
+		self.numentities -= 1
+
+	def get_entity(self, eid):
+		result = self.arena.get(eid)
+		return result
+
+
+'''
+The part of a game step that has to come out the same every time for the
+same inputs: the player, physics, attacks and the camera (which decides
+what gets simulated at which LOD). main() and replays both step this, and
+keyframes are its state. The AI and particles are outside it. The AI runs
+on a time budget per frame and the particles don't feed back into the
+world.
+
+Geometry never changes, so keyframes leave it out.
+'''
+class GameSim:
+	def __init__(self, worldstate, geometry, player, camera, physicsarrays=None):
+		self.worldstate = worldstate
+		self.geometry = geometry
+		self.player = player
+		self.camera = camera
+		self.physicsarrays = physicsarrays
+
+		self.inputdata = InputDataBuffer()
+
+		# attack hitboxes against bodies
+		self.combat = CombatStage()
+
+		self.stepnum = 0
+
+	# one physics step of dt seconds, after inputdata has this step's input
+	def step(self, dt=PHYSICS_TIME_STEP):
+		worldstate = self.worldstate
+		geometry = self.geometry
+		player = self.player
+
+		# update player state/forces by reading inputdata structure
+		for kind in player_handleinput(player, self.inputdata, dt):
+			self.combat.add_attack(player, kind)
+
+		# physics and logic updates
+		player_update(player.player, dt)
+
+		if (not self.physicsarrays is None):
+			self.physicsarrays.update(geometry, worldstate.spatialhash, dt=dt)
+		elif (SIM_LOD):
+			update_physicsbodies_lod(
+				worldstate.entities, geometry, self.camera, self.stepnum, worldstate.spatialhash,
+				dt=dt)
+		else:
+			update_physicsbodies(
+				worldstate.entities, worldstate.numentities, geometry, worldstate.spatialhash,
+				dt=dt)
+		self.stepnum += 1
+
+		# hits push their targets on the next step
+		apply_hits(self.combat.update(worldstate.spatialhash))
+
+		self.camera.update_pos(player.physics)
+
+	def get_keyframe(self):
+		result = {
+			"step" : self.stepnum,
+			"world" : self.worldstate.serialize(),
+			"input" : self.inputdata.serialize(),
+			"combat" : self.combat.serialize(),
+			"camera" : list(self.camera.pos),
+		}
+		return result
+
+	def load_keyframe(self, keyframe):
+		self.stepnum = keyframe["step"]
+		self.worldstate.load_ws(keyframe["world"])
+		self.inputdata.load(keyframe["input"])
+		self.combat.load(keyframe["combat"], self.worldstate)
+		self.camera.pos = tuple(keyframe["camera"])
+
+# the world main() plays in, without anything for drawing it
+def create_gamesim(spritebatch, mapname, screendim):
+	entityloader = EntityLoader(spritebatch)
+
+	physicsarrays = None
+	if (PHYSICS_ARRAYS):
+		physicsarrays = PhysicsArrays()
+
+	# world state
+	worldstate = WorldState(physicsarrays)
 
+	# geometry never changes, so no need to be in worldstate
+	geometry = MapData()
+	geometry.load(mapname, spritebatch)
+
+	# add player
+	player = entityloader.create_entity("player-local", position=geometry.get_spawn())
+	worldstate.add_entity(player)
+
+	camera = Camera(geometry.get_tile2pos(*geometry.spawn), screendim)
+
+	result = GameSim(worldstate, geometry, player, camera, physicsarrays)
+	return result
 
-def main():
+'''
+Binary log of a play session, written as it's played:
+	header: magic, version, how many input vars there are, the screen size
+		(the camera's game size comes from it) and the map name's length,
+		then the map name
+	every step: STEP, then every input var after newinput, a byte each
+	every keyframesteps steps, just before the step: KEYFRAME, the step
+		number and the length of the zlib'd json of GameSim.get_keyframe(),
+		then that
+replay.py plays it back. Only what GameSim steps is in a keyframe: MegaBrain,
+NavGraph and ParticleSystem live outside it, and the AI thinks on a wall clock
+budget, so once AI drives anything in the world a replay stops being bit
+identical to what was played.
+'''
+class InputRecorder:
+	HEADER = struct.Struct('<4sHHHHH')
+	KEYFRAMEHEADER = struct.Struct('<BII')
+	MAGIC = b'SWRP'
+	VERSION = 1
+	STEP = 0
+	KEYFRAME = 1
+
+	def __init__(self, filename, mapname, screendim, keyframesteps=REPLAY_KEYFRAME_STEPS):
+		self.fout = open(filename, 'wb')
+		self.keyframesteps = keyframesteps
+		self.numvars = len(InputDataIndex)
+		self.stepstruct = struct.Struct('<B%dB' % self.numvars)
+
+		name = mapname.encode('utf-8')
+		self.fout.write(InputRecorder.HEADER.pack(
+			InputRecorder.MAGIC, InputRecorder.VERSION, self.numvars,
+			int(screendim[0]), int(screendim[1]), len(name)))
+		self.fout.write(name)
+
+	# before the step's newinput
+	def add_keyframe(self, sim):
+		if (sim.stepnum % self.keyframesteps != 0):
+			return
+
+		data = zlib.compress(json.dumps(sim.get_keyframe()).encode('utf-8'))
+		self.fout.write(InputRecorder.KEYFRAMEHEADER.pack(
+			InputRecorder.KEYFRAME, sim.stepnum, len(data)))
+		self.fout.write(data)
+
+	# after the step's newinput
+	def add_step(self, inputdata):
+		values = [inputdata.get_var(vi) for vi in range(self.numvars)]
+		self.fout.write(self.stepstruct.pack(InputRecorder.STEP, *values))
+
+	def close(self):
+		self.fout.close()
+
+def main(recordfile=None):
 	pygame.init()
 
 	# Set the width and height of the screen (width, height).
 	screendim = (1024, 720) #use this value when move to C++
-	flags = DOUBLEBUF
+	# resizable so the camera refits, and at exactly twice the size the native
+	# res target goes through scale2x
+	flags = DOUBLEBUF | RESIZABLE
 	window = pygame.display.set_mode(screendim, flags)
 	window.set_alpha(None)
 	pygame.display.set_caption("swords")
@@ -1238,12 +4078,9 @@ def main():
 
 	# load data
 	spritebatch = SpriteBatch()
-	entityloader = EntityLoader(spritebatch)
 
 	# input stuff
-	prev_input = []
-	curr_input = [] # int list
-	inputdata = InputDataBuffer()
+	inputstate = InputState()
 
 	num_joysticks = pygame.joystick.get_count()
 	joystick = None
@@ -1254,16 +4091,29 @@ def main():
 		joystick.init()	
 	'''
 
-	# world state
-	worldstate = WorldState()
+	# world, player and everything else stepped by physics
+	mapname = "widemap1"
+	sim = create_gamesim(spritebatch, mapname, screendim)
+	worldstate = sim.worldstate
+	geometry = sim.geometry
+	player = sim.player
+	camera = sim.camera
 
-	# geometry never changes, so no need to be in worldstate
-	geometry = MapData()
-	geometry.load("widemap1", spritebatch)
+	# every step's input, to play back with replay.py
+	recorder = None
+	if (not recordfile is None):
+		recorder = InputRecorder(recordfile, mapname, screendim)
 
-	# add player
-	player = entityloader.create_entity("player-local", position=geometry.get_spawn())
-	worldstate.add_entity(player)
+	# nav graph for boar-sized bodies. paths get searched a slice per frame.
+	navgraph = NavGraph(geometry)
+
+	# enemies register their think functions here
+	megabrain = MegaBrain()
+
+	# spell particles, needs numpy
+	particles = None
+	if (not np is None):
+		particles = ParticleSystem()
 
 	# load fonts
 	font = pygame.font.Font('./data/fonts/ARI.ttf', 32)
@@ -1272,12 +4122,19 @@ def main():
 	Probably going to be setting up some memory constructs around here
 	'''
 
-	camera = Camera(geometry.get_tile2pos(*geometry.spawn), screendim)
-	screen = camera.get_camerascreen(window)
+	camerascreen = camera.get_camerascreen(window)
+	# everything draws onto screen, which may be an offscreen native-res target
+	screen = camera.get_rendertarget(camerascreen)
+
+	chunkrenderer = ChunkRenderer(geometry, spritebatch, grey)
+	# the final upscale touches the whole camera screen, so no dirty rects there
+	presenter = DirtyRectPresenter(
+		camera.screenoffset, enabled=(PRESENT_DIRTYRECTS and not camera.nativerender))
 
 	# timing stuff
 	t = 0.0
 	accum = 0.0
+	dt = PHYSICS_TIME_STEP # everything the step runs gets this
 
 	while not done:
 		frametime = clock.tick() # time passed in millisecondss
@@ -1289,124 +4146,79 @@ def main():
 		global highlight
 		highlight.clear()
 
-		# poll input and update physics 100 times a second
-		while (accum >= PHYSICS_TIME_STEP):
-			accum -= PHYSICS_TIME_STEP
-			t += PHYSICS_TIME_STEP
-
-			# poll input, put in curr_input and prev_input
-			events = pygame.event.get()
-
-			# add values to curr_input on input
-			for event in events:
-				if event.type == pygame.QUIT:
-					done = True
-				elif (event.type == pygame.JOYBUTTONDOWN or
-					event.type == pygame.KEYDOWN):
-					curr_input.append(event)
-
-				# if new axis/hat, then remove previous (if any) from curr_input
-				elif (event.type == pygame.JOYAXISMOTION or
-					event.type == pygame.JOYHATMOTION):
-					for cev in curr_input:
-						if (event.type == cev.type):
-							curr_input.remove(cev)
-					if (event.value != (0, 0)):
-						curr_input.append(event)
-
-			# remove values from curr_input on release of input
-			for r_event in events:
-				if (r_event.type == pygame.JOYBUTTONUP):
-					for event in curr_input:
-						if (event.type == pygame.JOYBUTTONDOWN and
-							event.button == r_event.button):
-							curr_input.remove(event)
-							break
-				elif (r_event.type == pygame.KEYUP):
-					for event in curr_input:
-						if (event.type == pygame.KEYDOWN and 
-							event.key == r_event.key):
-							curr_input.remove(event)
-							break
-
-			# skip update and quit if directed
-			for event in curr_input:
-				if (event.type == pygame.KEYDOWN and
-					event.key == pygame.K_ESCAPE):
-					done = True
-				elif (event.type == pygame.JOYBUTTONDOWN and
-					event.button == 6):
-					done = True
-			if (done):
-				break
+		# poll input once a frame
+		events = pygame.event.get()
+		for event in events:
+			if (event.type == pygame.VIDEORESIZE):
+				window = pygame.display.set_mode((event.w, event.h), flags)
+				window.set_alpha(None)
+				camera.update_window()
+				camerascreen = camera.get_camerascreen(window)
+				if (not camera.nativerender):
+					screen = camerascreen
+				presenter.reset(camera.screenoffset)
+		if (inputstate.poll(events)):
+			done = True
 
-			inputdata.newinput(curr_input)
+		# update physics 1/dt times a second
+		while (not done and accum >= dt):
+			accum -= dt
+			t += dt
 
-			# update player state/forces by reading inputdata structure
-			player_handleinput(player, inputdata)
+			if (not recorder is None):
+				recorder.add_keyframe(sim)
 
-			# physics and logic updates
-			player_update(player.player)
+			sim.inputdata.newinput(inputstate)
+			inputstate.clear_taps()
 
-			update_physicsbodies(worldstate.entities, worldstate.numentities, geometry)
+			if (not recorder is None):
+				recorder.add_step(sim.inputdata)
 
-			camera.update_pos(player.physics)
+			sim.step(dt)
 
-		# handle AI less often than physics?
-		#megabrain.update()
+			# queue up the agents whose turn it is to think
+			megabrain.step()
 
-		# start drawing
-		screen.fill(grey)
+			if (not particles is None):
+				particles.update(geometry, dt)
 
-		# get camera maptile range
-		camerabounds = camera.get_maptilebounds(geometry)
-		camera_minx = max(camerabounds.x-1, 0)
-		camera_miny = max(camerabounds.y-1, 0)
-		camera_maxx = min(camerabounds.x + camerabounds.width, geometry.width)
-		camera_maxy = min(camerabounds.y + camerabounds.height, geometry.height)
+		# handle AI less often than physics, within a budget per frame
+		megabrain.update(AI_FRAME_BUDGET_SEC)
+		navgraph.update(NAV_EXPANSIONS_PER_FRAME)
 
-		# draw sprites
-		blitlist = []
+		if (not sim.physicsarrays is None):
+			sim.physicsarrays.sync_entities()
 
-		# draw background
+		# start drawing
+		spritebatch.set_zoom(camera.renderzoom)
+		if (presenter.begin(camera)):
+			screen.fill(grey)
 
-		# draw middle ground sprites
-		for j in range(camera_miny, camera_maxy):
-			for i in range(camera_minx, camera_maxx):
-				si = geometry.get_mgspriteindex(i, j)
-				if (si >= 0):
-					rect = Rect(
-						geometry.get_tile2pos(i, j, offset=False), 
-						(TILE_WIDTH*2, TILE_WIDTH*2)
-					)
-					rect = camera.get_screenrect(rect)
-					blitlist.append(spritebatch.draw(si, rect))
-		screen.blits(blitlist)
-		blitlist.clear()
-
-		# draw geometry sprites
-		for j in range(camera_miny, camera_maxy):
-			for i in range(camera_minx, camera_maxx):
-				si = geometry.get_geospriteindex(i, j)
-				if (si >= 0):
-					rect = Rect(
-						geometry.get_tile2pos(i, j, offset=False), 
-						(TILE_WIDTH*2, TILE_WIDTH*2)
-					)
-					rect = camera.get_screenrect(rect)
-					blitlist.append(spritebatch.draw(si, rect))
-		screen.blits(blitlist)
-		blitlist.clear()
+			# draw background
+
+			# draw middle ground and geometry sprites
+			chunkrenderer.draw(screen, camera)
+		else:
+			# camera is still, so only put the map back under last frame's stuff
+			for rect in presenter.get_stalerects():
+				screen.set_clip(rect)
+				screen.fill(grey)
+				chunkrenderer.draw(screen, camera)
+			screen.set_clip(None)
 
 		# draw player
 		playerblit = player.draw(spritebatch, camera)
-		screen.blit(*playerblit)
+		presenter.add(screen.blit(*playerblit))
+
+		# draw particles
+		if (not particles is None):
+			for rect in particles.draw(screen, camera):
+				presenter.add(rect)
 		
 
 		# highlight tiles for debug
 		# TODO: fix this to align to cameras
-		DEBUG = False
-		if (DEBUG):
+		if (DEBUG_HIGHLIGHT):
 			colorlines = {}
 			ci = 0
 			for tile, color in highlight:
@@ -1419,11 +4231,16 @@ def main():
 						(tile.width-ci*2, tile.height-ci*2)
 					)
 				)
-				pygame.draw.rect(screen, pygame.Color(color), rect.get_pyrect(), 1)
+				presenter.add(
+					pygame.draw.rect(screen, pygame.Color(color), rect.get_pyrect(), 1))
 
-		screen.blit(fps_text, (1, 1))
-		
-		pygame.display.flip()
+		presenter.add(screen.blit(fps_text, (1, 1)))
+
+		camera.upscale_rendertarget(screen, camerascreen)
+		presenter.present()
+
+	if (not recorder is None):
+		recorder.close()
 
 	pygame.quit()
 
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import sys
+import time
+import zlib
+
+import main
+
+'''
+Debug driver for the logs main.py writes with InputRecorder.
+
+	python replay.py record <file>
+		plays normally and logs every step's input to file
+	python replay.py <file> [step]
+		plays file back uncapped from the latest keyframe at or before step,
+		checks the keyframes after it and prints steps/sec and a hash of the
+		final state, to compare a change's speed and output against a run
+		from before it
+'''
+
+class InputLog:
+	def __init__(self, filename):
+		fin = open(filename, 'rb')
+		data = fin.read()
+		fin.close()
+
+		magic, version, numvars, width, height, namelen = main.InputRecorder.HEADER.unpack_from(data, 0)
+		assert(magic == main.InputRecorder.MAGIC and version == main.InputRecorder.VERSION)
+		offset = main.InputRecorder.HEADER.size
+		self.mapname = data[offset:offset+namelen].decode('utf-8')
+		offset += namelen
+		self.screendim = (width, height)
+		self.numvars = numvars
+
+		self.steps = [] # input vars of every step, as bytes
+		self.keyframes = {} # step -> json
+		stepsize = 1 + numvars
+		while (offset < len(data)):
+			if (data[offset] == main.InputRecorder.STEP):
+				self.steps.append(data[offset+1:offset+stepsize])
+				offset += stepsize
+			else:
+				tag, step, length = main.InputRecorder.KEYFRAMEHEADER.unpack_from(data, offset)
+				offset += main.InputRecorder.KEYFRAMEHEADER.size
+				self.keyframes[step] = zlib.decompress(data[offset:offset+length]).decode('utf-8')
+				offset += length
+
+	# latest keyframe at or before step, or None
+	def get_keyframestep(self, step):
+		result = None
+		for kstep in self.keyframes:
+			if (kstep <= step and (result is None or kstep > result)):
+				result = kstep
+		return result
+
+'''
+Plays an InputLog back through GameSim as fast as it'll go, starting from the
+latest keyframe at or before startstep. With verify, every later keyframe in
+the log is checked against the state the replay has got to, which has to
+match to the bit. That time isn't counted.
+
+Returns (steps played, seconds, steps whose keyframes didn't match, sha1 of
+the final state), so runs of the same log before and after a change can be
+compared for speed and for output.
+'''
+def replay_inputlog(filename, startstep=0, verify=True):
+	log = InputLog(filename)
+	assert(log.numvars == len(main.InputDataIndex))
+
+	spritebatch = main.SpriteBatch()
+	sim = main.create_gamesim(spritebatch, log.mapname, log.screendim)
+
+	firststep = log.get_keyframestep(startstep)
+	if (firststep is None):
+		firststep = 0
+	else:
+		sim.load_keyframe(json.loads(log.keyframes[firststep]))
+
+	mismatches = []
+	verifytime = 0.0
+	inputdata = sim.inputdata
+	steps = log.steps
+	start = time.perf_counter()
+	for stepi in range(firststep, len(steps)):
+		if (verify and stepi != firststep and stepi in log.keyframes):
+			verifystart = time.perf_counter()
+			if (json.dumps(sim.get_keyframe()) != log.keyframes[stepi]):
+				mismatches.append(stepi)
+			verifytime += time.perf_counter() - verifystart
+
+		inputdata.push()
+		values = steps[stepi]
+		for vi in range(len(values)):
+			inputdata.set_var(vi, values[vi])
+		sim.step()
+	seconds = time.perf_counter() - start - verifytime
+
+	digest = hashlib.sha1(json.dumps(sim.get_keyframe()).encode('utf-8')).hexdigest()
+	result = (len(steps) - firststep, seconds, mismatches, digest)
+	return result
+
+def run_replay(filename, startstep=0):
+	steps, seconds, mismatches, digest = replay_inputlog(filename, startstep)
+	print("replayed %d steps in %.3f sec (%.0f steps/sec)" % (
+		steps, seconds, steps / max(seconds, 1e-9)))
+	if (len(mismatches) > 0):
+		print("keyframes that don't match: %s" % mismatches)
+	else:
+		print("every keyframe matches")
+	print("final state %s" % digest)
+
+def run(argv):
+	if (len(argv) > 1 and argv[0] == 'record'):
+		main.main(recordfile=argv[1])
+	elif (len(argv) > 0):
+		startstep = 0
+		if (len(argv) > 1):
+			startstep = int(argv[1])
+		run_replay(argv[0], startstep)
+	else:
+		print("usage: replay.py record <file> | replay.py <file> [step]")
+
+if __name__=='__main__':
+	run(sys.argv[1:])
@@ -0,0 +1,22 @@
+import pygame
+import main
+
+
+def test_sprites_load_from_atlas_pages_only(monkeypatch, spritebatch):
+	loaded = []
+	load = pygame.image.load
+	def countload(filename, *args):
+		loaded.append(filename)
+		return load(filename, *args)
+	monkeypatch.setattr(pygame.image, 'load', countload)
+
+	for name in spritebatch.spritedata:
+		spritebatch.add(name)
+	pages = [page["file"] for page in spritebatch.atlas.atlasdata["atlases"].values()]
+	assert sorted(loaded) == sorted(pages)
+
+
+def test_changed_spritedata_ignores_atlas(spritebatch):
+	name = sorted(spritebatch.spritedata)[0]
+	assert main.TextureAtlas().has(name)
+	assert not main.TextureAtlas(spritedatahash='changed').has(name)
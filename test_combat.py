@@ -0,0 +1,75 @@
+import pygame
+import pytest
+import main
+
+
+# a game sim with a target just in front of the player
+@pytest.fixture
+def create_sim(spritebatch, create_body):
+	def create():
+		sim = main.create_gamesim(spritebatch, "widemap", (1024, 720))
+		player = sim.player
+		target = create_body(
+			(player.x + player.physics.rect().width + 4, player.y), heightintiles=2)
+		sim.worldstate.add_entity(target)
+		player.facing_direction = 1
+		return sim, target
+	return create
+
+
+def step(sim, inputstate, dt=main.PHYSICS_TIME_STEP):
+	sim.inputdata.newinput(inputstate)
+	sim.step(dt)
+	inputstate.clear_taps()
+
+
+# steps the light attack's hitbox is out for
+def swing_light(sim, dt=main.PHYSICS_TIME_STEP):
+	inputstate = main.InputState()
+	inputstate.keys.add(pygame.K_f)
+	step(sim, inputstate, dt)
+	inputstate.keys.discard(pygame.K_f)
+
+	result = 0
+	step(sim, inputstate, dt)
+	while (sim.combat.hitboxes):
+		result += 1
+		step(sim, inputstate, dt)
+		assert result < 100
+	return result
+
+
+def test_light_attack_knocks_target_away(capsys, create_sim):
+	sim, target = create_sim()
+	startx = target.x
+	swingsteps = swing_light(sim)
+	# attacking stays quiet, replays run through here too
+	assert capsys.readouterr().out == ''
+
+	# the hitbox is out for as long as the attacker's swing
+	assert sim.player.player.attack_timer == 0.0
+	assert abs(swingsteps - main.LIGHT_ATTACK_SEC/main.PHYSICS_TIME_STEP) <= 1
+	assert target.x - startx > main.TILE_WIDTH/2
+
+
+def test_swing_lasts_as_long_at_any_step(create_sim):
+	dt = 3*main.PHYSICS_TIME_STEP
+	swingsteps = swing_light(create_sim()[0], dt)
+	assert abs(swingsteps - main.LIGHT_ATTACK_SEC/dt) <= 1
+
+
+def test_release_after_heavy_is_not_light(create_sim):
+	sim, target = create_sim()
+	inputstate = main.InputState()
+	inputstate.keys.add(pygame.K_f)
+	kinds = []
+	for i in range(int(main.HOLDBUTTONTIMESHORT/main.PHYSICS_TIME_STEP) + 5):
+		sim.inputdata.newinput(inputstate)
+		kinds += main.player_handleinput(sim.player, sim.inputdata)
+		main.player_update(sim.player.player)
+	inputstate.keys.discard(pygame.K_f)
+	for i in range(5):
+		sim.inputdata.newinput(inputstate)
+		kinds += main.player_handleinput(sim.player, sim.inputdata)
+		main.player_update(sim.player.player)
+	assert kinds == [main.AttackKind.HEAVY]
@@ -0,0 +1,61 @@
+import pygame
+import main
+
+
+def press(inputstate, *keys):
+	inputstate.keys = set(keys)
+
+
+def test_newinput_directions():
+	inputstate = main.InputState()
+	inputdata = main.InputDataBuffer()
+	cases = [
+		((pygame.K_DOWN,), main.InputMoveDir.DOWN),
+		((pygame.K_UP,), main.InputMoveDir.UP),
+		((pygame.K_DOWN, pygame.K_RIGHT), main.InputMoveDir.DOWN_RIGHT),
+		((pygame.K_DOWN, pygame.K_LEFT), main.InputMoveDir.DOWN_LEFT),
+		((pygame.K_UP, pygame.K_RIGHT), main.InputMoveDir.UP_RIGHT),
+		((pygame.K_UP, pygame.K_LEFT), main.InputMoveDir.UP_LEFT),
+	]
+	for keys, movedir in cases:
+		press(inputstate, *keys)
+		inputdata.newinput(inputstate)
+		assert inputdata.get_var(main.InputDataIndex.MOVE_DIR) == movedir
+
+
+def test_hat_directions():
+	inputstate = main.InputState()
+	inputdata = main.InputDataBuffer()
+	for hat, movedir in (((1, -1), main.InputMoveDir.DOWN_RIGHT), ((-1, 1), main.InputMoveDir.UP_LEFT)):
+		inputstate.hat = hat
+		inputdata.newinput(inputstate)
+		assert inputdata.get_var(main.InputDataIndex.MOVE_DIR) == movedir
+
+
+def run_motion(motion):
+	inputstate = main.InputState()
+	inputdata = main.InputDataBuffer()
+	matcher = main.ComboMatcher(main.spell_combotrie)
+	result = []
+	for keys in motion:
+		press(inputstate, *keys)
+		inputdata.newinput(inputstate)
+		result.extend(matcher.update(inputdata))
+	return result
+
+
+def test_spell_motions_from_keys():
+	down, up, left, right, f = pygame.K_DOWN, pygame.K_UP, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_f
+
+	motion = [(down,), (down, right), (right,), (right, f)]
+	assert run_motion(motion) == [(main.SpellMotion.BODY, 1)]
+
+	motion = [(down,), (down, left), (left,), (left, f)]
+	assert run_motion(motion) == [(main.SpellMotion.BODY, -1)]
+
+	motion = [(up,), (up, right), (right,), (right, f)]
+	assert run_motion(motion) == [(main.SpellMotion.MIND, 1)]
+
+	# wrong way round in the middle
+	motion = [(down,), (up, right), (right,), (right, f)]
+	assert run_motion(motion) == []
@@ -0,0 +1,33 @@
+import main
+
+
+def run(navgraph, request):
+	while (request.status == main.PathRequest.PENDING):
+		navgraph.update()
+
+
+def test_found_paths_are_bounded(monkeypatch, load_map):
+	monkeypatch.setattr(main, 'NAV_PATHCACHE_SIZE', 2)
+	navgraph = main.NavGraph(load_map())
+	nodes = sorted(navgraph.nodes)
+	start = nodes[0]
+	requests = [navgraph.request_path(start, goal) for goal in nodes[:3]]
+	for request in requests:
+		run(navgraph, request)
+	assert len(navgraph.requests) == 0
+	assert len(navgraph.paths) == 2
+
+	# the oldest was evicted, asking for the newer ones again hands them back
+	assert navgraph.request_path(start, nodes[2]) is requests[2]
+	assert navgraph.request_path(start, nodes[1]) is requests[1]
+	assert navgraph.request_path(start, nodes[0]) is not requests[0]
+
+
+def test_failed_requests_are_not_kept(load_map):
+	navgraph = main.NavGraph(load_map())
+	start = sorted(navgraph.nodes)[0]
+	offgraph = (-5, -5)
+	request = navgraph.request_path(start, offgraph)
+	assert request.status == main.PathRequest.FAILED
+	assert navgraph.request_path(start, offgraph) is not request
+	assert len(navgraph.requests) == 0 and len(navgraph.paths) == 0
@@ -0,0 +1,97 @@
+import random
+import pygame
+import main
+
+
+def step(worldstate, geometry, player, inputstate, inputdata, dt=main.PHYSICS_TIME_STEP, **kwargs):
+	inputdata.newinput(inputstate)
+	main.player_handleinput(player, inputdata, dt)
+	main.player_update(player.player, dt)
+	main.update_physicsbodies(
+		worldstate.entities, worldstate.numentities, geometry, worldstate.spatialhash, dt=dt, **kwargs)
+
+
+def overlaps_geometry(geometry, rect):
+	eps = 0.0001
+	result = geometry.any_geointiles(
+		int((rect.x+eps)//main.TILE_WIDTH), int((rect.y+eps)//main.TILE_WIDTH),
+		int((rect.x+rect.width-eps)//main.TILE_WIDTH), int((rect.y+rect.height-eps)//main.TILE_WIDTH))
+	return result
+
+
+def test_swept_resting_body_stays_put(create_world):
+	# the spawn on smallmap overlaps geometry, which mustn't push the player out
+	worldstate, geometry, player = create_world("smallmap")
+	start = (player.x, player.y)
+	inputstate = main.InputState()
+	inputdata = main.InputDataBuffer()
+	for i in range(300):
+		step(worldstate, geometry, player, inputstate, inputdata, swept=True)
+	assert (player.x, player.y) == start
+
+
+def test_swept_never_ends_in_geometry(create_world):
+	for dt in (main.PHYSICS_TIME_STEP, 4*main.PHYSICS_TIME_STEP):
+		worldstate, geometry, player = create_world("widemap")
+		inputstate = main.InputState()
+		inputdata = main.InputDataBuffer()
+		rng = random.Random(1)
+		keys = [pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE]
+		for i in range(2000):
+			if (rng.random() < 0.05):
+				key = rng.choice(keys)
+				if (key in inputstate.keys):
+					inputstate.keys.discard(key)
+				else:
+					inputstate.keys.add(key)
+			step(worldstate, geometry, player, inputstate, inputdata, dt=dt, swept=True)
+			assert not overlaps_geometry(geometry, player.physics.rect())
+			assert 0 <= player.y < geometry.height*main.TILE_WIDTH
+
+
+def test_lod_coarse_keeps_skipped_forces(create_world, create_body):
+	worldstate, geometry, player = create_world("widemap")
+	camera = main.Camera(geometry.get_tile2pos(*geometry.spawn), (1024, 720))
+	bounds = camera.get_maptilebounds(geometry)
+	# past the right of the screen, in coarse range and with nothing below it
+	x = (bounds.x + bounds.width + main.LOD_FULL_TILES + 2) * main.TILE_WIDTH
+	body = create_body((x, 0))
+	pb = body.physics
+	while (overlaps_geometry(geometry, pb.rect().get_fat().get_fat())):
+		body.y += main.TILE_WIDTH
+	worldstate.add_entity(body)
+	assert main.get_simlod(body, bounds) == main.SimLOD.COARSE
+
+	force = 50.0
+	pushed = False
+	for stepnum in range(4*main.LOD_COARSE_STEPS):
+		settled = (stepnum > 2*main.LOD_COARSE_STEPS)
+		if (not pushed and settled and stepnum - pb.simstep < main.LOD_COARSE_STEPS):
+			# a push for one step the body isn't stepped on, once its steps are settled
+			pb.addforce((0, force))
+			pushed = True
+		main.update_physicsbodies_lod(worldstate.entities, geometry, camera, stepnum)
+	assert pushed
+	assert abs(pb.dpy - force*main.TILE_WIDTH*main.PHYSICS_TIME_STEP/pb.mass) < 1e-9
+
+
+def test_resolve_probes_with_step_dt(load_map, create_body):
+	geometry = load_map()
+	# an empty tile with open air to its left and a wall to its right
+	tx, ty = next((x, y)
+		for y in range(geometry.height) for x in range(1, geometry.width-1)
+		if (not geometry.get_geo(x-1, y) and not geometry.get_geo(x, y) and geometry.get_geo(x+1, y)))
+	tw = main.TILE_WIDTH
+	dt = 3*main.PHYSICS_TIME_STEP
+	body = create_body((tx*tw - tw/2, ty*tw))
+	pb = body.physics
+	# half a tile short of the wall, covers that in less than dt but not in one step
+	pb.dp = (tw/4/main.PHYSICS_TIME_STEP, 0.0)
+	rect = pb.rect().copy()
+	rect.x += pb.dpx * dt
+	numtiles = geometry.get_georectsfromrect(rect)
+
+	resolved = main.resolve_geocollision(pb, rect, geometry.georectscratch, numtiles, geometry, dt)
+	assert pb.get_collideshorz()
+	assert pb.dpx == 0
+	assert resolved.x + tw <= (tx+1)*tw
@@ -0,0 +1,58 @@
+import random
+import main
+
+
+def test_raycast_many_matches_raycast(load_map):
+	geometry = load_map()
+	rng = random.Random(3)
+	width = geometry.width*main.TILE_WIDTH
+	height = geometry.height*main.TILE_WIDTH
+	rays = []
+	for i in range(2000):
+		# some start and end off the map, some stay in one row or column
+		x0 = rng.uniform(-2*main.TILE_WIDTH, width + 2*main.TILE_WIDTH)
+		y0 = rng.uniform(-2*main.TILE_WIDTH, height + 2*main.TILE_WIDTH)
+		x1 = rng.uniform(-2*main.TILE_WIDTH, width + 2*main.TILE_WIDTH)
+		y1 = rng.uniform(-2*main.TILE_WIDTH, height + 2*main.TILE_WIDTH)
+		if (i % 4 == 1):
+			y1 = y0
+		elif (i % 4 == 2):
+			x1 = x0
+		rays.append((x0, y0, x1, y1))
+
+	expected = [geometry.raycast(*ray) for ray in rays]
+	assert geometry.raycast_many(rays) == expected
+	assert any(hit is None for hit in expected)
+	assert any(not hit is None for hit in expected)
+
+
+def test_lineofsight_cache_follows_geometry(load_map):
+	geometry = load_map()
+	origin = geometry.spawn
+	target = (origin[0] + 3, origin[1])
+	while (geometry.get_geo(*target)):
+		target = (target[0] - 1, target[1])
+	blocker = (origin[0] + 1, origin[1])
+	geometry.set_geo(blocker[0], blocker[1], False)
+	assert geometry.get_lineofsight(origin, target)
+
+	geometry.set_geo(blocker[0], blocker[1], True)
+	assert not geometry.get_lineofsight(origin, target)
+	assert geometry.raycast_many([
+		geometry.get_tile2pos(*origin) + geometry.get_tile2pos(*target)]) == [blocker]
+
+
+def test_lineofsight_cache_is_bounded(monkeypatch, load_map):
+	monkeypatch.setattr(main, 'RAYCACHE_SIZE', 3)
+	geometry = load_map()
+	origin = geometry.spawn
+	targets = [(x, origin[1]) for x in range(geometry.width)]
+	for target in targets:
+		geometry.get_lineofsight(origin, target)
+	assert len(geometry.raycache) == 3
+
+	# asking again keeps a sight line, the least recently asked for goes
+	geometry.get_lineofsight(origin, targets[-3])
+	geometry.get_lineofsight(origin, targets[0])
+	assert list(geometry.raycache) == [
+		(origin, targets[-1]), (origin, targets[-3]), (origin, targets[0])]
@@ -0,0 +1,80 @@
+import tracemalloc
+import main
+
+
+STEADY_STEPS = 100
+RESTING_BODIES = 10
+AWAKE_BODIES = 5
+
+
+'''
+The first RESTING_BODIES players rest on the floor until they fall asleep,
+the next AWAKE_BODIES stand on it too but get a push that changes every step
+so they never sleep and resolve against the floor every step, and the rest
+drift through the open air off the side of the map with no forces on them.
+'''
+def create_bodies(create_world, entityloader, numentities):
+	worldstate, geometry, player = create_world()
+	grounded = [player]
+	for i in range(1, numentities):
+		if (i < RESTING_BODIES + AWAKE_BODIES):
+			e = entityloader.create_entity("player-local", position=geometry.get_spawn())
+			grounded.append(e)
+		else:
+			x = (geometry.width + 10 + i % 8) * main.TILE_WIDTH
+			e = entityloader.create_entity("player-local", position=(x, main.TILE_WIDTH))
+			e.physics.dp = (main.TILE_WIDTH, 0.0)
+		worldstate.add_entity(e)
+	return worldstate, geometry, grounded
+
+
+def add_forces(grounded, stepnum):
+	for e in grounded:
+		main.player_update(e.player)
+	for e in grounded[RESTING_BODIES:]:
+		e.physics.addforce((0.1 if stepnum % 2 else -0.1, 0.0))
+
+
+def skip_step(entities, numentities, geometry):
+	pass
+
+
+# most bytes allocated at once during a steady step over what there was
+# before it, and bytes still allocated after all the steps. the forces are
+# added outside of what's measured. the measuring keeps a couple of ints of
+# its own, so what a step allocates is this less measure_steps with skip_step.
+def measure_steps(create_world, entityloader, numentities, step=main.update_physicsbodies):
+	# traced from the start, so every float the bodies swap in and out is
+	# one tracemalloc has seen allocated
+	tracemalloc.start()
+	worldstate, geometry, grounded = create_bodies(create_world, entityloader, numentities)
+	entities = worldstate.entities
+	for stepnum in range(main.SLEEP_STEPS * 2):
+		add_forces(grounded, stepnum)
+		main.update_physicsbodies(entities, numentities, geometry)
+	assert all(e.physics.sleeping for e in grounded[:RESTING_BODIES])
+	assert not any(e.physics.sleeping for e in grounded[RESTING_BODIES:])
+
+	start = tracemalloc.get_traced_memory()[0]
+	peak = 0
+	for stepnum in range(STEADY_STEPS):
+		add_forces(grounded, stepnum)
+		before = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		step(entities, numentities, geometry)
+		peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+	retained = tracemalloc.get_traced_memory()[0] - start
+	tracemalloc.stop()
+
+	# still standing on the floor, so every step went through contact resolution
+	assert all(e.physics.get_collidedown() for e in grounded[RESTING_BODIES:])
+
+	result = (peak, retained)
+	return result
+
+
+def test_steady_steps_allocate_nothing(create_world, entityloader):
+	for numentities in (20, 200):
+		steps = measure_steps(create_world, entityloader, numentities)
+		skipped = measure_steps(create_world, entityloader, numentities, skip_step)
+		assert steps == skipped
@@ -0,0 +1,28 @@
+import pytest
+import main
+
+
+def test_remove_entity_leaves_physics_arrays(create_body):
+	physicsarrays = main.PhysicsArrays()
+	worldstate = main.WorldState(physicsarrays)
+	entities = [create_body((i*100.0, 0.0)) for i in range(4)]
+	for e in entities:
+		worldstate.add_entity(e)
+	assert physicsarrays.count == 4
+
+	worldstate.remove_entity(entities[1].id)
+	assert physicsarrays.count == 3
+	assert worldstate.numentities == 3
+	# the body moved into the freed slot is still where it was
+	for e in (entities[0], entities[2], entities[3]):
+		assert e.physics.get_pos() == (e.x, e.y)
+		assert physicsarrays.bodies[e.physics.slot] is e.physics
+
+
+def test_arena_slots_fit_in_id(monkeypatch, create_body):
+	monkeypatch.setattr(main, 'ENTITYID_SLOTBITS', 2)
+	arena = main.EntityArena()
+	for i in range(4):
+		arena.add(create_body((0.0, 0.0)))
+	with pytest.raises(AssertionError):
+		arena.add(create_body((0.0, 0.0)))